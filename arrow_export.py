@@ -0,0 +1,213 @@
+"""
+回测结果导出为 Arrow IPC / Parquet
+股价、均线等 float64 列直接由 NumPy 数组的内存构造 Arrow 数组（pa.Array.from_buffers），不复制数据；
+交易信号、持仓和紧凑模式的 float32 列先转换成统一的列类型；绩效指标和回测参数写进 schema 的元数据
+也可以把每次回测追加写入按参数分区的 Parquet 数据集，用 open_dataset 按固定的 schema 读取
+需要安装 pyarrow
+"""
+import json
+import os
+import uuid
+from typing import Dict, Any, Optional, Sequence
+
+import numpy as np
+
+from backtest_core import compact_signal
+from timeframe_pyramid import trading_dates
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow as pa
+    except ImportError as e:
+        raise ImportError("导出 Arrow / Parquet 需要安装 pyarrow：pip install pyarrow") from e
+    return pa
+
+
+# 导出的列，与 stock_df 的列名相同；不带均线时只导出前三列
+CORE_COLUMNS = ['股票收盘价', '交易信号', '最终持仓状态']
+INDICATOR_COLUMNS = ['5日均线价格', '20日均线价格', '均线差值', '买入价格', '浮亏比例', '股票日收益率', '策略日收益']
+# 导出文件的列类型与引擎、是否紧凑模式无关，各种回测可以放进同一个数据集：
+# 价格和指标列一律 float64（紧凑模式的 float32 在导出时转换），持仓为 int8（0/1），
+# 交易信号为可空的 int8（1 买入、0 卖出、null 无信号）
+SIGNAL_COLUMN = '交易信号'
+POSITION_COLUMN = '最终持仓状态'
+# 数据集分区字段的类型；不在表里的参数按字符串处理
+PARTITION_TYPES = {'ma5_window': 'int64', 'ma20_window': 'int64', 'stop_loss_threshold': 'float64',
+                   'init_price': 'float64', 'risk_free_rate': 'float64', 'random_seed': 'int64',
+                   'periods_per_year': 'float64', 'compact': 'bool', 'engine': 'string', 'freq': 'string'}
+DEFAULT_PARTITION_BY = ('ma5_window', 'ma20_window', 'stop_loss_threshold')
+
+
+def _column_dtype(name: str):
+    return np.int8 if name in (SIGNAL_COLUMN, POSITION_COLUMN) else np.float64
+
+
+def file_schema(include_indicators: bool = True):
+    """
+    导出文件的 schema（不含元数据）
+    """
+    pa = _require_pyarrow()
+    columns = CORE_COLUMNS + (INDICATOR_COLUMNS if include_indicators else [])
+    return pa.schema([pa.field('交易日期', pa.timestamp('ns'))] +
+                     [pa.field(name, pa.from_numpy_dtype(_column_dtype(name))) for name in columns])
+
+
+def dataset_schema(partition_by: Sequence[str] = DEFAULT_PARTITION_BY):
+    """
+    数据集的完整 schema：全部列 + 类型确定的分区字段
+    不带均线导出的文件读出时，均线等列为 null
+    """
+    pa = _require_pyarrow()
+    schema = file_schema(include_indicators=True)
+    for name in partition_by:
+        schema = schema.append(pa.field(name, pa.type_for_alias(PARTITION_TYPES.get(name, 'string'))))
+    return schema
+
+
+def numpy_to_arrow(arr: np.ndarray, valid: Optional[np.ndarray] = None):
+    """
+    把一维数值数组包装成 Arrow 数组，连续内存时不复制（Arrow 数组持有对原数组的引用）
+    NaN 保留为 NaN，不转换成 null，与 stock_df 的含义一致
+     valid: 可选的 bool 掩码（紧凑模式的交易信号），False 的位置在 Arrow 中为 null
+    """
+    pa = _require_pyarrow()
+    arr = np.ascontiguousarray(arr)             # 已经连续时不会复制
+    if arr.dtype == np.bool_:
+        return pa.array(arr)                    # Arrow 的布尔是按位存储的，只能转换
+    arrow_type = pa.from_numpy_dtype(arr.dtype)
+    validity = None if valid is None else pa.array(valid).buffers()[1]     # 掩码按位打包，只复制掩码
+    null_count = -1 if valid is None else int(valid.shape[0] - np.count_nonzero(valid))
+    return pa.Array.from_buffers(arrow_type, arr.shape[0], [validity, pa.py_buffer(arr)], null_count=null_count)
+
+
+def backtest_metrics(test) -> Dict[str, Any]:
+    metrics = {name: getattr(test, name) for name in test.RESULT_METRICS}
+    return {name: None if value is None else (int(value) if name in ('day_count', 'max_drawdown_duration')
+                                              else float(value))
+            for name, value in metrics.items()}
+
+
+def backtest_table(test, include_indicators: bool = True):
+    """
+    把一次已完成的回测转成 pyarrow.Table
+     test: 已经 run() 过的 MAStopLossBacktest
+     include_indicators: 是否导出均线、买入价格、日收益等中间列
+    """
+    pa = _require_pyarrow()
+    columns = CORE_COLUMNS + (INDICATOR_COLUMNS if include_indicators else [])
+    if test.arrays is None and test.stock_df is None:
+        # 结果缓存命中但缓存里没有数组时，只有绩效，没有可导出的序列
+        raise ValueError("回测中没有股价、交易信号和持仓数据：请先 run()；结果来自结果缓存时，"
+                         "需使用 ResultCache(store_arrays=True)，或 run() 时画图以重算这些数组")
+
+    if test.engine == 'numpy' and not include_indicators and test.arrays is not None:
+        # numpy 引擎不带中间列时直接用结果数组，不构建数据框
+        values = {'股票收盘价': test.arrays['price'], '最终持仓状态': test.arrays['position']}
+        dates = test.date_list if test.date_list is not None else \
+            trading_dates(test.start_date, test.end_date, test.freq)
+    else:
+        df = test.stock_df
+        values = {name: df[name].to_numpy() for name in columns if name != '交易信号'}
+        dates = df.index
+    if test.compact:
+        values['交易信号'], signal_mask = test.arrays['trade_signal'], test.arrays['signal_mask']
+    else:
+        # 1/0/NaN 的浮点信号转成 int8 + 掩码（只复制这一列）
+        signal = test.arrays['trade_signal'] if test.engine == 'numpy' else test.stock_df['交易信号'].to_numpy()
+        values['交易信号'], signal_mask = compact_signal(signal)
+    masks = {'交易信号': signal_mask}
+    # 统一列类型：类型已经相同的列不复制，紧凑模式的 float32 / bool 列和普通模式的浮点持仓列在这里转换
+    values = {name: np.asarray(value, dtype=_column_dtype(name)) for name, value in values.items()}
+
+    # 日期按 int64 纳秒时间戳共享内存
+    date_values = np.ascontiguousarray(dates.asi8)
+    arrays = [pa.Array.from_buffers(pa.timestamp('ns'), date_values.shape[0], [None, pa.py_buffer(date_values)])]
+    arrays += [numpy_to_arrow(values[name], masks.get(name)) for name in columns]
+
+    metadata = {
+        'backtest_metrics': json.dumps(backtest_metrics(test)),
+        'backtest_params': json.dumps(test.cache_params(), default=str),
+    }
+    return pa.Table.from_arrays(arrays, schema=file_schema(include_indicators).with_metadata(metadata))
+
+
+def read_metadata(schema) -> Dict[str, Any]:
+    """
+    从 schema 元数据中读出 {'metrics': 绩效, 'params': 参数}
+    """
+    metadata = schema.metadata or {}
+    return {key: json.loads(metadata[f'backtest_{key}'.encode()])
+            for key in ('metrics', 'params') if f'backtest_{key}'.encode() in metadata}
+
+
+def write_ipc(table, path: str) -> None:
+    pa = _require_pyarrow()
+    with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+
+
+def read_ipc(path: str):
+    """
+    以内存映射方式读取 Arrow IPC 文件，列数据不复制进内存
+    """
+    pa = _require_pyarrow()
+    with pa.memory_map(path, 'r') as source:
+        return pa.ipc.open_file(source).read_all()
+
+
+def write_parquet(table, path: str, compression: str = 'zstd') -> None:
+    _require_pyarrow()
+    import pyarrow.parquet as pq
+    pq.write_table(table, path, compression=compression)
+
+
+def export_backtest(test, path: str, include_indicators: bool = True, compression: str = 'zstd') -> None:
+    """
+    导出一次回测，按扩展名选择格式：.parquet 为 Parquet，.arrow / .feather / .ipc 为 Arrow IPC
+    """
+    table = backtest_table(test, include_indicators)
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.parquet':
+        write_parquet(table, path, compression)
+    elif ext in ('.arrow', '.feather', '.ipc'):
+        write_ipc(table, path)
+    else:
+        raise ValueError(f"无法由扩展名判断导出格式：{path}")
+
+
+def append_to_dataset(test, root: str, partition_by: Sequence[str] = DEFAULT_PARTITION_BY,
+                      include_indicators: bool = True, run_id: Optional[str] = None,
+                      compression: str = 'zstd') -> str:
+    """
+    把一次回测追加到按参数分区（hive 风格目录，如 ma5_window=5/ma20_window=20/...）的 Parquet 数据集
+    每次回测写一个新文件，不改动已有文件；绩效另存一行到 root/_metrics（以 _ 开头，读取数据集时会被忽略）
+    返回本次的 run_id
+    用 open_dataset(root) 读取全部回测
+    """
+    run_id = run_id or uuid.uuid4().hex
+    params = test.cache_params()
+    partition_dir = os.path.join(root, *[f"{name}={params[name]}" for name in partition_by])
+    os.makedirs(partition_dir, exist_ok=True)
+    table = backtest_table(test, include_indicators)
+    write_parquet(table, os.path.join(partition_dir, f"run-{run_id}.parquet"), compression)
+
+    pa = _require_pyarrow()
+    metrics_dir = os.path.join(root, '_metrics')
+    os.makedirs(metrics_dir, exist_ok=True)
+    row = {'run_id': run_id, **{name: str(value) if not isinstance(value, (int, float)) else value
+                                for name, value in params.items()}, **backtest_metrics(test)}
+    write_parquet(pa.Table.from_pylist([row]), os.path.join(metrics_dir, f"run-{run_id}.parquet"), compression)
+    return run_id
+
+
+def open_dataset(root: str, partition_by: Sequence[str] = DEFAULT_PARTITION_BY):
+    """
+    打开 append_to_dataset 写出的数据集，使用固定的 schema，不从第一个文件推断列类型和分区类型
+     partition_by: 与写入时相同
+    """
+    pa = _require_pyarrow()
+    import pyarrow.dataset as ds
+    schema = dataset_schema(partition_by)
+    partitioning = ds.partitioning(pa.schema([schema.field(name) for name in partition_by]), flavor='hive')
+    return ds.dataset(root, schema=schema, format='parquet', partitioning=partitioning)
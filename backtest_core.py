@@ -0,0 +1,328 @@
+"""
+均线金叉死叉+止损策略的纯 NumPy 计算核心
+与 MAStopLossBacktest 的 pandas 流程逻辑一致，但只使用连续的 NumPy 数组，
+方便参数扫描等需要成千上万次回测的场景复用
+"""
+import numpy as np
+from typing import Dict, Any, Tuple
+
+# numba 为可选依赖：安装了就用编译后的持仓状态机，没有就退回纯 NumPy 实现
+try:
+    from numba import njit
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+
+TRADING_DAYS_PER_YEAR = 252     # 年交易日数
+
+
+def generate_price_np(day_count: int, init_price: float = 100.0, random_seed: int = 101) -> np.ndarray:
+    """
+    生成模拟股价，与 generate_stock_data 使用同一随机序列
+    使用独立的 RandomState，不改动全局随机种子
+    """
+    rng = np.random.RandomState(random_seed)
+    daily_change = rng.uniform(-0.02, 0.02, day_count)                 # 每日涨幅
+    price_np = np.ones(day_count) * init_price
+    price_np[1:] = init_price * np.cumprod(1 + daily_change[1:])      # 每日股价
+    return price_np
+
+
+def cumsum_np(price: np.ndarray) -> np.ndarray:
+    """
+    沿第 0 轴的累加和，前面补一行 0，长度比 price 多 1
+    """
+    price = np.asarray(price, dtype=np.float64)
+    csum = np.zeros((price.shape[0] + 1,) + price.shape[1:])
+    np.cumsum(price, axis=0, out=csum[1:])
+    return csum
+
+
+def rolling_mean_from_csum(csum: np.ndarray, window: int, dtype=np.float64) -> np.ndarray:
+    """
+    由 cumsum_np 的结果计算任意窗口的滚动均值，O(n)
+     dtype: 结果的类型；累加和始终是 float64，float32 结果只在最后一步舍入
+    """
+    ma = np.full((csum.shape[0] - 1,) + csum.shape[1:], np.nan, dtype=dtype)
+    if window <= 0 or window > ma.shape[0]:
+        return ma
+    ma[window - 1:] = (csum[window:] - csum[:-window]) / window
+    return ma
+
+
+def rolling_mean_np(price: np.ndarray, window: int) -> np.ndarray:
+    """
+    用累加和计算滚动均值，前 window-1 个值为 NaN（与 rolling().mean() 一致）
+    支持一维（单只股票）和二维（交易日 × 股票）数组，沿第 0 轴滚动
+    """
+    return rolling_mean_from_csum(cumsum_np(price), window)
+
+
+def ma_diff_np(price: np.ndarray, ma5_window: int, ma20_window: int, dtype=np.float64,
+               block_size: int = 1024) -> np.ndarray:
+    """
+    短均线减长均线，两条均线共用一次累加和
+    二维输入时按 block_size 列一块计算，float64 的累加和只占一块的内存
+    """
+    price = np.asarray(price)
+    if price.ndim == 1:
+        csum = cumsum_np(price)
+        return rolling_mean_from_csum(csum, ma5_window, dtype) - rolling_mean_from_csum(csum, ma20_window, dtype)
+    ma_diff = np.empty(price.shape, dtype=dtype)
+    for start in range(0, price.shape[1], block_size):
+        csum = cumsum_np(price[:, start:start + block_size])
+        np.subtract(rolling_mean_from_csum(csum, ma5_window, dtype), rolling_mean_from_csum(csum, ma20_window, dtype),
+                    out=ma_diff[:, start:start + block_size])
+    return ma_diff
+
+
+def ffill_np(arr: np.ndarray) -> np.ndarray:
+    """
+    沿第 0 轴向前填充 NaN，相当于 fillna(method='ffill')
+    """
+    valid = ~np.isnan(arr)
+    row_idx = np.arange(arr.shape[0]).reshape((-1,) + (1,) * (arr.ndim - 1))
+    idx = np.where(valid, row_idx, 0)
+    np.maximum.accumulate(idx, axis=0, out=idx)
+    return np.take_along_axis(arr, idx, axis=0)
+
+
+def crossover_signal_np(ma_diff: np.ndarray) -> np.ndarray:
+    """
+    根据均线差值生成交易信号：金叉 1、死叉 0、无信号 NaN
+    """
+    prev_diff = np.empty_like(ma_diff)
+    prev_diff[0] = np.nan
+    prev_diff[1:] = ma_diff[:-1]
+    signal = np.full(ma_diff.shape, np.nan)
+    # NaN 参与比较结果为 False，与 pandas 的 shift 比较一致
+    with np.errstate(invalid='ignore'):
+        signal[(prev_diff < 0) & (ma_diff >= 0)] = 1
+        signal[(prev_diff > 0) & (ma_diff <= 0)] = 0
+    return signal
+
+
+def crossover_codes_np(ma_diff: np.ndarray) -> np.ndarray:
+    """
+    紧凑版的 crossover_signal_np：int8 的 金叉 1、死叉 0、无信号 -1，可直接传给 position_kernel_compact
+    """
+    codes = np.full(ma_diff.shape, -1, dtype=np.int8)
+    with np.errstate(invalid='ignore'):
+        codes[1:][(ma_diff[:-1] < 0) & (ma_diff[1:] >= 0)] = 1
+        codes[1:][(ma_diff[:-1] > 0) & (ma_diff[1:] <= 0)] = 0
+    return codes
+
+
+def _position_kernel_py(price: np.ndarray, signal: np.ndarray, stop_loss_threshold: float,
+                        trade_signal: np.ndarray, entry_price: np.ndarray, position: np.ndarray,
+                        holding: bool, e: float) -> Tuple[bool, float]:
+    """
+    纯 NumPy 版持仓状态机：按笔交易循环，每笔交易内部用向量化查找止损点
+    每根K线只被扫描一次，循环次数等于交易笔数
+    holding / e 为开始时的持仓状态和买入价格，返回结束时的状态（分块回测时接续用）
+    """
+    n = price.shape[0]
+    buy_idx = np.flatnonzero(signal == 1)
+    sell_idx = np.flatnonzero(signal == 0)
+    t = 0
+    while True:
+        if holding:
+            # 接续上一块未平仓的仓位，从第一根K线开始检查死叉和止损
+            first = t
+        else:
+            # 空仓时遇到的第一个金叉开仓
+            k = np.searchsorted(buy_idx, t)
+            if k == buy_idx.shape[0]:
+                break
+            entry = buy_idx[k]
+            e = price[entry]
+            trade_signal[entry] = 1
+            position[entry] = 1
+            entry_price[entry] = e
+            first = entry + 1
+
+        # 持仓期间第一个死叉或第一次触发止损平仓，取较早者
+        j = np.searchsorted(sell_idx, first)
+        exit_ = sell_idx[j] if j < sell_idx.shape[0] else n
+        hit = (price[first:exit_] - e) / e <= stop_loss_threshold
+        if hit.any():
+            exit_ = first + np.argmax(hit)
+
+        position[first:exit_] = 1
+        entry_price[first:exit_ + 1] = e
+        if exit_ >= n:
+            holding = True
+            break
+        trade_signal[exit_] = 0
+        holding = False
+        t = exit_ + 1
+    return holding, e
+
+
+if HAS_NUMBA:
+    @njit(cache=True)
+    def _position_kernel_numba(price, signal, stop_loss_threshold, trade_signal, entry_price, position,
+                               holding, e):
+        # 单次遍历的状态机：持仓时先看死叉再看止损，空仓时看金叉
+        for t in range(price.shape[0]):
+            if holding:
+                entry_price[t] = e
+                if signal[t] == 0 or (price[t] - e) / e <= stop_loss_threshold:
+                    holding = False
+                    trade_signal[t] = 0
+                else:
+                    position[t] = 1
+            elif signal[t] == 1:
+                holding = True
+                e = price[t]
+                trade_signal[t] = 1
+                entry_price[t] = e
+                position[t] = 1
+        return holding, e
+
+
+_position_kernel = _position_kernel_numba if HAS_NUMBA else _position_kernel_py
+
+
+def position_kernel(price: np.ndarray, signal: np.ndarray,
+                    stop_loss_threshold: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    路径相关的持仓状态机，单次 O(n) 遍历
+     空仓时遇到金叉（信号 1）开仓，记录当日收盘价为买入价
+     持仓时遇到死叉（信号 0）或浮亏比例 <= 止损阈值时平仓，买入价随之失效
+     平仓后只有下一次金叉才会重新开仓，持仓中重复出现的金叉不改变买入价
+    支持一维和二维（交易日 × 股票）输入，二维时逐列计算
+    返回 (实际交易信号 1/0/NaN, 买入价格（持仓期间含平仓当天，空仓为 NaN）, 持仓状态 0/1)
+    """
+    price = np.asarray(price, dtype=np.float64)
+    signal = np.asarray(signal, dtype=np.float64)
+    trade_signal = np.full(price.shape, np.nan)
+    entry_price = np.full(price.shape, np.nan)
+    position = np.zeros(price.shape)
+    return _run_position_kernel(price, signal, stop_loss_threshold, trade_signal, entry_price, position)
+
+
+def position_kernel_compact(price: np.ndarray, signal: np.ndarray,
+                            stop_loss_threshold: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    紧凑版的 position_kernel：股价按原类型（通常是 float32）参与计算，信号为 crossover_codes_np 的 int8
+    返回 (交易信号 int8（无信号处为 0）, 信号掩码 bool（True 表示当天有买卖）, 买入价格 float32, 持仓状态 bool)
+    """
+    trade_signal = np.full(price.shape, -1, dtype=np.int8)
+    entry_price = np.full(price.shape, np.nan, dtype=np.float32)
+    position = np.zeros(price.shape, dtype=np.int8)
+    trade_signal, entry_price, position = _run_position_kernel(np.asarray(price), np.asarray(signal, dtype=np.int8),
+                                                               stop_loss_threshold, trade_signal, entry_price,
+                                                               position)
+    signal_mask = trade_signal >= 0
+    np.maximum(trade_signal, 0, out=trade_signal)
+    return trade_signal, signal_mask, entry_price, position.view(np.bool_)
+
+
+def compact_signal(trade_signal: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    1/0/NaN 的浮点交易信号 -> (int8 交易信号, bool 掩码)
+    """
+    signal_mask = ~np.isnan(trade_signal)
+    return np.where(signal_mask, trade_signal, 0).astype(np.int8), signal_mask
+
+
+def expand_signal(trade_signal: np.ndarray, signal_mask: np.ndarray) -> np.ndarray:
+    """
+    (int8 交易信号, bool 掩码) -> 1/0/NaN 的浮点交易信号
+    """
+    return np.where(signal_mask, trade_signal, np.nan)
+
+
+def _run_position_kernel(price, signal, stop_loss_threshold, trade_signal, entry_price, position):
+    if price.ndim == 1:
+        _position_kernel(price, signal, stop_loss_threshold, trade_signal, entry_price, position, False, np.nan)
+    else:
+        # 转成按列连续存储，逐列调用内核后再写回
+        price_t, signal_t = np.ascontiguousarray(price.T), np.ascontiguousarray(signal.T)
+        trade_t, entry_t, position_t = trade_signal.T.copy(), entry_price.T.copy(), position.T.copy()
+        for j in range(price_t.shape[0]):
+            _position_kernel(price_t[j], signal_t[j], stop_loss_threshold,
+                             trade_t[j], entry_t[j], position_t[j], False, np.nan)
+        trade_signal, entry_price, position = trade_t.T, entry_t.T, position_t.T
+    return trade_signal, entry_price, position
+
+
+def position_kernel_chunk(price: np.ndarray, signal: np.ndarray, stop_loss_threshold: float,
+                          holding: bool = False, entry: float = np.nan) -> Tuple[np.ndarray, np.ndarray,
+                                                                                  np.ndarray, bool, float]:
+    """
+    一维分块版的 position_kernel：从给定的持仓状态和买入价格开始，
+    额外返回这一块结束时的 (持仓状态, 买入价格)，交给下一块接续
+    """
+    price = np.ascontiguousarray(price, dtype=np.float64)
+    signal = np.ascontiguousarray(signal, dtype=np.float64)
+    trade_signal = np.full(price.shape, np.nan)
+    entry_price = np.full(price.shape, np.nan)
+    position = np.zeros(price.shape)
+    holding, entry = _position_kernel(price, signal, stop_loss_threshold, trade_signal, entry_price, position,
+                                      bool(holding), float(entry))
+    return trade_signal, entry_price, position, bool(holding), float(entry)
+
+
+def position_np(price: np.ndarray, signal: np.ndarray, stop_loss_threshold: float) -> np.ndarray:
+    """
+    止损 + 最终持仓状态，由 position_kernel 的状态机计算
+    """
+    return position_kernel(price, signal, stop_loss_threshold)[2]
+
+
+def return_metrics_np(strategy_return: np.ndarray, day_count: int, risk_free_rate: float = 0.03,
+                      periods_per_year: float = TRADING_DAYS_PER_YEAR) -> Dict[str, Any]:
+    """
+    由策略日收益（已去掉第一天）计算总收益、年化收益、年化波动率和夏普比率
+    二维输入时按列分别计算，返回的每个指标是一维数组
+     periods_per_year: 每年K线数，日线为 252，分钟线等由K线周期换算（见 timeframe_pyramid.bars_per_year）
+    """
+    # 累乘和标准差都用 float64 累计，float32 的收益也不会积累舍入误差
+    total_strategy_return = np.prod(1 + strategy_return, axis=0, dtype=np.float64)
+    annual_strategy_return = total_strategy_return ** (periods_per_year / day_count) - 1
+    if strategy_return.shape[0] > 1:
+        daily_volatility = strategy_return.std(axis=0, ddof=1, dtype=np.float64)
+    else:
+        daily_volatility = np.full(strategy_return.shape[1:], np.nan)
+    annual_volatility = daily_volatility * np.sqrt(periods_per_year)
+
+    # 波动率为 0（或无法计算）时夏普比率记为 0
+    valid = (annual_volatility != 0) & ~np.isnan(annual_volatility)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sharpe_ratio = np.where(valid, (annual_strategy_return - risk_free_rate) / annual_volatility, 0.0)
+
+    return {
+        "total_strategy_return": total_strategy_return - 1,
+        "annual_strategy_return": annual_strategy_return,
+        "annual_volatility": annual_volatility,
+        "sharpe_ratio": sharpe_ratio[()],      # 一维输入时取出标量
+    }
+
+
+def performance_np(price: np.ndarray, position: np.ndarray, risk_free_rate: float = 0.03,
+                   periods_per_year: float = TRADING_DAYS_PER_YEAR) -> Dict[str, Any]:
+    """
+    计算收益、波动率和夏普比率，口径与 calculate_performance 一致
+    """
+    day_count = price.shape[0]
+    daily_return = price[1:] / price[:-1] - 1               # 第一天没有收益率，直接去掉
+    strategy_return = daily_return * position[1:]
+
+    result = {"total_benchmark_return": np.prod(1 + daily_return, axis=0, dtype=np.float64) - 1}
+    result.update(return_metrics_np(strategy_return, day_count, risk_free_rate, periods_per_year))
+    return result
+
+
+def backtest_np(price: np.ndarray, ma5_window: int = 5, ma20_window: int = 20,
+                stop_loss_threshold: float = -0.05, risk_free_rate: float = 0.03,
+                periods_per_year: float = TRADING_DAYS_PER_YEAR) -> Dict[str, Any]:
+    """
+    一次完整回测：均线 -> 信号 -> 止损持仓 -> 绩效
+    """
+    ma_diff = rolling_mean_np(price, ma5_window) - rolling_mean_np(price, ma20_window)
+    signal = crossover_signal_np(ma_diff)
+    position = position_np(price, signal, stop_loss_threshold)
+    return performance_np(price, position, risk_free_rate, periods_per_year)
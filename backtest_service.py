@@ -0,0 +1,283 @@
+"""
+回测任务服务
+本地 HTTP 服务，接收 JSON 格式的回测任务，交给常驻的进程池执行；子进程启动时已经导入好 pandas / NumPy
+并预热过一次回测，之后每个任务不再付出解释器启动和导入的开销。结果按完成顺序以 NDJSON 流式返回
+
+接口：
+  POST /jobs     请求体为一个或一组 MAStopLossBacktest 构造参数，如 {"ma5_window": 5, "ma20_window": 30}
+                 响应每行一个 JSON：{"job_id": 序号, "params": {...}, "metrics": {...}} 或 {"job_id", "error"}
+  GET  /health   服务状态
+
+用法：
+  python backtest_service.py --port 8765 --workers 4 --cache-dir .backtest_cache
+"""
+import argparse
+import json
+import math
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, Any, Iterator, List, Optional, Union
+from urllib.request import Request, urlopen
+
+
+# 允许通过接口传入的构造参数（都是可以 JSON 序列化的）
+JOB_PARAMS = ('start_date', 'end_date', 'init_price', 'stop_loss_threshold', 'risk_free_rate',
+              'ma5_window', 'ma20_window', 'random_seed', 'engine', 'freq', 'periods_per_year')
+MAX_JOBS_PER_REQUEST = 10_000
+# 与 MAStopLossBacktest 的默认值相同，用于检查只传了一部分参数的任务
+JOB_DEFAULTS = {'start_date': '2025-01-01', 'end_date': '2025-12-31', 'ma5_window': 5, 'ma20_window': 20}
+ENGINES = ('pandas', 'numpy')
+
+_worker_cache = None
+
+
+def _warm_worker(cache_dir: Optional[str]) -> None:
+    """
+    子进程初始化：导入回测模块并跑一次很小的回测，让导入和 numba 编译都发生在接任务之前
+    """
+    global _worker_cache
+    from try_change import MAStopLossBacktest
+    if cache_dir is not None:
+        from result_cache import ResultCache
+        _worker_cache = ResultCache(cache_dir)
+    MAStopLossBacktest(end_date='2025-03-31', engine='numpy').run(plot=False, verbose=False)
+
+
+def _ping(_) -> None:
+    pass
+
+
+def _run_job(params: Dict[str, Any]) -> Dict[str, Any]:
+    from try_change import MAStopLossBacktest
+    test = MAStopLossBacktest(result_cache=_worker_cache, **params)
+    test.run(plot=False, verbose=False)
+    metrics = {name: getattr(test, name) for name in MAStopLossBacktest.RESULT_METRICS}
+    metrics['day_count'] = int(metrics['day_count'])
+    metrics['max_drawdown_duration'] = int(metrics['max_drawdown_duration'])
+    metrics = {name: value if isinstance(value, int) else float(value) for name, value in metrics.items()}
+    metrics['run_time'] = test.run_time
+    metrics['cache_hit'] = test.cache_hit
+    return metrics
+
+
+def validate_jobs(payload: Union[Dict[str, Any], List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """
+    检查请求体，返回任务参数列表；不合法时抛出 ValueError
+    """
+    jobs = payload if isinstance(payload, list) else [payload]
+    if not jobs or len(jobs) > MAX_JOBS_PER_REQUEST:
+        raise ValueError(f"每次请求的任务数应在 1 到 {MAX_JOBS_PER_REQUEST} 之间")
+    for job in jobs:
+        if not isinstance(job, dict):
+            raise ValueError("每个任务必须是 JSON 对象")
+        unknown = set(job) - set(JOB_PARAMS)
+        if unknown:
+            raise ValueError(f"不支持的参数：{sorted(unknown)}")
+        _validate_values(job)
+    return jobs
+
+
+def _check_number(job: Dict[str, Any], name: str, integer: bool = False, low: Optional[float] = None,
+                  high: Optional[float] = None, low_inclusive: bool = True) -> None:
+    # 参数存在时检查类型和范围（bool 虽然是 int 的子类，也不接受）
+    if name not in job:
+        return
+    value = job[name]
+    types = (int,) if integer else (int, float)
+    if isinstance(value, bool) or not isinstance(value, types) or not math.isfinite(value):
+        raise ValueError(f"{name} 必须是{'整数' if integer else '数值'}，收到：{value!r}")
+    if low is not None and (value < low if low_inclusive else value <= low):
+        raise ValueError(f"{name} 必须 {'≥' if low_inclusive else '>'} {low}，收到：{value!r}")
+    if high is not None and value > high:
+        raise ValueError(f"{name} 必须 ≤ {high}，收到：{value!r}")
+
+
+def _validate_values(job: Dict[str, Any]) -> None:
+    """
+    检查各参数的类型和取值范围，避免不合法的任务进了进程池才报错
+    """
+    import pandas as pd
+
+    _check_number(job, 'ma5_window', integer=True, low=1)
+    _check_number(job, 'ma20_window', integer=True, low=1)
+    _check_number(job, 'random_seed', integer=True, low=0, high=2 ** 32 - 1)
+    _check_number(job, 'init_price', low=0, low_inclusive=False)
+    _check_number(job, 'stop_loss_threshold', low=-1, high=0, low_inclusive=False)
+    _check_number(job, 'risk_free_rate', low=-1, low_inclusive=False)
+    if job.get('periods_per_year') is not None:
+        _check_number(job, 'periods_per_year', low=0, low_inclusive=False)
+    ma5_window = job.get('ma5_window', JOB_DEFAULTS['ma5_window'])
+    ma20_window = job.get('ma20_window', JOB_DEFAULTS['ma20_window'])
+    if ma5_window >= ma20_window:
+        raise ValueError(f"短均线窗口必须小于长均线窗口，收到：{ma5_window} / {ma20_window}")
+
+    if 'engine' in job and job['engine'] not in ENGINES:
+        raise ValueError(f"engine 只能是 {' 或 '.join(ENGINES)}，收到：{job['engine']!r}")
+    if 'freq' in job:
+        try:
+            if not isinstance(job['freq'], str):
+                raise TypeError
+            pd.tseries.frequencies.to_offset(job['freq'])
+        except (TypeError, ValueError):
+            raise ValueError(f"无法识别的K线周期：{job['freq']!r}") from None
+
+    dates = {}
+    for name in ('start_date', 'end_date'):
+        value = job.get(name, JOB_DEFAULTS[name])
+        try:
+            if not isinstance(value, str):
+                raise TypeError
+            dates[name] = pd.Timestamp(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"{name} 必须是日期字符串，如 2025-01-01，收到：{value!r}") from None
+    if dates['start_date'] > dates['end_date']:
+        raise ValueError(f"start_date 不能晚于 end_date：{dates['start_date']} / {dates['end_date']}")
+
+
+class BacktestService:
+    """
+    持有常驻进程池的回测服务
+    """
+    def __init__(self, host: str = '127.0.0.1', port: int = 8765, max_workers: Optional[int] = None,
+                 cache_dir: Optional[str] = None):
+        """
+         host / port: 监听地址，默认只监听本机
+         max_workers: 进程数，默认 CPU 核数
+         cache_dir: 可选，结果缓存目录，重复提交同一组参数时直接返回缓存结果
+        """
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.executor = ProcessPoolExecutor(max_workers=self.max_workers, initializer=_warm_worker,
+                                            initargs=(cache_dir,))
+        # 进程池按需启动子进程，先提交一批空任务把所有进程拉起来并完成预热
+        list(self.executor.map(_ping, range(self.max_workers)))
+        self.pending = 0
+        self.completed = 0
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._make_handler())
+        self.server.daemon_threads = True
+
+    @property
+    def address(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def submit(self, jobs: List[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        """
+        提交一组任务，按完成顺序逐个产出结果
+        """
+        with self._lock:
+            self.pending += len(jobs)
+        futures = {}
+        for job_id, params in enumerate(jobs):
+            future = self.executor.submit(_run_job, params)
+            future.add_done_callback(self._job_done)
+            futures[future] = (job_id, params)
+        try:
+            for future in as_completed(futures):
+                job_id, params = futures[future]
+                try:
+                    yield {"job_id": job_id, "params": params, "metrics": future.result()}
+                except Exception as exc:       # 单个任务出错不影响其他任务
+                    yield {"job_id": job_id, "params": params, "error": f"{type(exc).__name__}: {exc}"}
+        finally:
+            # 客户端断开时取消还没开始的任务
+            for future in futures:
+                future.cancel()
+
+    def _job_done(self, future) -> None:
+        with self._lock:
+            self.pending -= 1
+            if not future.cancelled():
+                self.completed += 1
+
+    def _make_handler(self):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # HTTP/1.0：不写 Content-Length，结果逐行写出，写完关闭连接即结束
+            def _send_json(self, status: int, body: Dict[str, Any]) -> None:
+                data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path != '/health':
+                    self._send_json(404, {"error": "not found"})
+                    return
+                self._send_json(200, {"status": "ok", "workers": service.max_workers,
+                                      "pending": service.pending, "completed": service.completed})
+
+            def do_POST(self):
+                if self.path != '/jobs':
+                    self._send_json(404, {"error": "not found"})
+                    return
+                try:
+                    length = int(self.headers.get('Content-Length', 0))
+                    jobs = validate_jobs(json.loads(self.rfile.read(length)))
+                except ValueError as exc:          # json.JSONDecodeError 也是 ValueError
+                    self._send_json(400, {"error": str(exc)})
+                    return
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-ndjson; charset=utf-8')
+                self.end_headers()
+                results = service.submit(jobs)
+                try:
+                    for result in results:
+                        self.wfile.write((json.dumps(result, ensure_ascii=False) + '\n').encode('utf-8'))
+                        self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+                finally:
+                    results.close()
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def serve_forever(self) -> None:
+        try:
+            self.server.serve_forever()
+        finally:
+            self.shutdown()
+
+    def shutdown(self) -> None:
+        self.server.server_close()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def submit_jobs(url: str, jobs: Union[Dict[str, Any], List[Dict[str, Any]]],
+                timeout: Optional[float] = None) -> Iterator[Dict[str, Any]]:
+    """
+    客户端：把任务提交给服务，按完成顺序逐个产出结果
+     url: 服务地址，如 http://127.0.0.1:8765
+    """
+    request = Request(url.rstrip('/') + '/jobs', data=json.dumps(jobs).encode('utf-8'),
+                      headers={'Content-Type': 'application/json'}, method='POST')
+    with urlopen(request, timeout=timeout) as response:
+        for line in response:
+            if line.strip():
+                yield json.loads(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="回测任务服务")
+    parser.add_argument("--host", default='127.0.0.1')
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, help="进程数，默认 CPU 核数")
+    parser.add_argument("--cache-dir", help="结果缓存目录")
+    args = parser.parse_args()
+
+    service = BacktestService(args.host, args.port, args.workers, args.cache_dir)
+    print(f"回测服务已启动：{service.address}（{service.max_workers} 个进程）")
+    service.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""
+回测引擎基准测试
+在 250 到 5000 万根K线的模拟股价上分别跑各个引擎，记录吞吐量（K线/秒）、峰值内存，
+并检查各引擎的结果是否与纯 NumPy 核心一致；还可以保存基线，之后对比发现性能退化
+
+用法：
+  python benchmark.py                               # 默认规模
+  python benchmark.py --preset full                 # 一直跑到 5000 万根K线
+  python benchmark.py --save-baseline bench.json    # 保存基线
+  python benchmark.py --compare bench.json          # 与基线对比，有退化时返回码为 1
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import runpy
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, Any, List, Optional
+
+import numpy as np
+import pandas as pd
+
+import backtest_core
+from backtest_core import generate_price_np, backtest_np
+from chunked_backtest import ChunkedBacktest
+from param_sweep import run_param_sweep
+from stream_backtest import MAStopLossStream
+from try_change import MAStopLossBacktest
+
+
+PRESETS = {
+    "quick": [250, 2_500, 25_000, 250_000, 2_500_000],
+    "full": [250, 2_500, 25_000, 250_000, 2_500_000, 10_000_000, 50_000_000],
+}
+GRID_SIZES = [(2, 2, 2), (4, 5, 3), (8, 10, 4)]        # 参数扫描的网格规模（短均线 × 长均线 × 止损）
+
+# 各引擎能跑的最大K线数：类引擎按起止日期生成日线（受 pandas 时间戳范围限制），流式引擎是逐根K线的 Python 循环
+MAX_BARS = {
+    "class_pandas": 50_000,
+    "class_numpy": 50_000,
+    "stream": 250_000,
+}
+METRIC_NAMES = ["total_benchmark_return", "total_strategy_return", "annual_strategy_return",
+                "annual_volatility", "sharpe_ratio"]
+START_DATE = '2025-01-01'
+RANDOM_SEED = 101
+
+
+def _run_class(engine: str, end_date) -> Dict[str, Any]:
+    test = MAStopLossBacktest(start_date=START_DATE, end_date=end_date, random_seed=RANDOM_SEED, engine=engine)
+    test.generate_stock_data()
+    test.calculate_ma()
+    test.generate_trade_signal()
+    test.calculate_performance()
+    return {name: getattr(test, name) for name in METRIC_NAMES}
+
+
+def _run_stream(price: np.ndarray) -> Dict[str, Any]:
+    stream = MAStopLossStream()
+    for i, p in enumerate(price):
+        stream.update(i, p)
+    return {name: getattr(stream, name) for name in METRIC_NAMES}
+
+
+def _run_chunked(price: np.ndarray, chunksize: int = 1_000_000) -> Dict[str, Any]:
+    backtest = ChunkedBacktest()
+    for start in range(0, price.shape[0], chunksize):
+        backtest.process_chunk(price[start:start + chunksize])
+    return backtest.results()
+
+
+def build_engines(bar_count: int, price: np.ndarray) -> Dict[str, Callable[[], Dict[str, Any]]]:
+    """
+    返回这个规模下可以跑的 {引擎名: 无参函数}
+    """
+    # 类引擎用起止日期生成数据，先算出对应 bar_count 根K线的结束日期（不计入耗时）
+    end_date = pd.bdate_range(START_DATE, periods=bar_count)[-1] if bar_count <= MAX_BARS["class_pandas"] else None
+    engines = {
+        "core_numpy": lambda: backtest_np(price),
+        "chunked": lambda: _run_chunked(price),
+        "class_pandas": lambda: _run_class('pandas', end_date),
+        "class_numpy": lambda: _run_class('numpy', end_date),
+        "stream": lambda: _run_stream(price),
+    }
+    return {name: func for name, func in engines.items() if bar_count <= MAX_BARS.get(name, bar_count)}
+
+
+def measure(func: Callable[[], Any], repeat: int, trace_memory: bool) -> Dict[str, Any]:
+    """
+    先预热一次（numba 编译、导入等不计入），计时取多次中的最好成绩；
+    峰值内存单独再跑一次（tracemalloc 会拖慢速度）
+    """
+    func()
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+
+    peak_memory = None
+    if trace_memory:
+        tracemalloc.start()
+        func()
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return {"seconds": best, "peak_memory": peak_memory, "result": result}
+
+
+def max_metric_diff(result: Dict[str, Any], reference: Dict[str, Any]) -> float:
+    return max(abs(float(result[name]) - float(reference[name])) for name in METRIC_NAMES)
+
+
+def check_sweep(table: pd.DataFrame, price: np.ndarray, sample_count: int = 4) -> float:
+    """
+    从参数扫描结果里均匀抽几行（含首尾），与同参数的单次 backtest_np 比对，返回最大误差
+    """
+    rows = table.iloc[np.unique(np.linspace(0, len(table) - 1, sample_count).astype(int))]
+    return max(max_metric_diff(row, backtest_np(price, int(row["ma5_window"]), int(row["ma20_window"]),
+                                                 float(row["stop_loss_threshold"])))
+               for _, row in rows.iterrows())
+
+
+def check_control_script() -> Dict[str, Any]:
+    """
+    control.py 是脚本，只能在它写死的 1 年数据上跑；在无界面后端下执行一次，与类的结果比对
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    start = time.perf_counter()
+    script_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'control.py')
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        script_globals = runpy.run_path(script_path)
+    seconds = time.perf_counter() - start
+
+    script_result = {
+        "total_benchmark_return": script_globals["total_benchmark_return"],
+        "total_strategy_return": script_globals["total_strategy_return_final"],
+        "annual_strategy_return": script_globals["annual_strategy_return"],
+        "annual_volatility": script_globals["annual_volatility"],
+        "sharpe_ratio": script_globals["sharpe_ratio"],
+    }
+    bar_count = script_globals["day_count"]
+    reference = _run_class('pandas', pd.bdate_range(START_DATE, periods=bar_count)[-1])
+    return {"bar_count": bar_count, "seconds": seconds, "max_diff": max_metric_diff(script_result, reference)}
+
+
+def run_benchmarks(sizes: List[int], repeat: int = 3, trace_memory: bool = True,
+                   tolerance: float = 1e-8) -> Dict[str, Any]:
+    cases = {}
+    for bar_count in sizes:
+        price = generate_price_np(bar_count, random_seed=RANDOM_SEED)
+        reference = None
+        for name, func in build_engines(bar_count, price).items():
+            stats = measure(func, repeat if bar_count < 10_000_000 else 1, trace_memory)
+            if reference is None:
+                reference = stats["result"]         # 第一个引擎（core_numpy）作为参照
+            diff = max_metric_diff(stats["result"], reference)
+            cases[f"{name}@{bar_count}"] = {
+                "engine": name,
+                "bar_count": bar_count,
+                "seconds": stats["seconds"],
+                "bars_per_sec": bar_count / stats["seconds"],
+                "peak_memory": stats["peak_memory"],
+                "max_diff": diff,
+                "equivalent": diff <= tolerance,
+            }
+            print(f"{name:>14} {bar_count:>12,} 根K线  {stats['seconds']:9.4f} 秒  "
+                  f"{bar_count / stats['seconds']:>14,.0f} K线/秒  "
+                  f"峰值内存 {(stats['peak_memory'] or 0) / 1e6:9.1f} MB  最大误差 {diff:.1e}")
+
+    # 参数扫描：一年数据（run_param_sweep 的默认区间和随机种子），不同网格大小，吞吐量按 参数组合数 × K线数 计算
+    bar_count = len(pd.bdate_range('2025-01-01', '2025-12-31'))
+    sweep_price = generate_price_np(bar_count, random_seed=RANDOM_SEED)
+    for ma5_count, ma20_count, stop_count in GRID_SIZES:
+        combo_count = ma5_count * ma20_count * stop_count
+        func = lambda: run_param_sweep(range(3, 3 + ma5_count), range(20, 20 + 5 * ma20_count, 5),
+                                       np.linspace(-0.02, -0.1, stop_count), random_seed=RANDOM_SEED,
+                                       max_workers=1)
+        stats = measure(func, repeat, trace_memory=False)
+        diff = check_sweep(stats["result"], sweep_price)
+        cases[f"sweep@{combo_count}"] = {
+            "engine": "sweep",
+            "bar_count": bar_count * combo_count,
+            "seconds": stats["seconds"],
+            "bars_per_sec": bar_count * combo_count / stats["seconds"],
+            "peak_memory": None,
+            "max_diff": diff,
+            "equivalent": diff <= tolerance,
+        }
+        print(f"{'sweep':>14} {combo_count:>12,} 个组合  {stats['seconds']:9.4f} 秒  最大误差 {diff:.1e}")
+
+    control = check_control_script()
+    print(f"\ncontrol.py 与 MAStopLossBacktest 结果最大误差：{control['max_diff']:.1e}"
+          f"（{control['bar_count']} 根K线，含画图 {control['seconds']:.2f} 秒）")
+
+    return {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "numba": backtest_core.HAS_NUMBA,
+        },
+        "control_script": control,
+        "cases": cases,
+    }
+
+
+def compare_with_baseline(report: Dict[str, Any], baseline_path: str, max_slowdown: float) -> bool:
+    """
+    吞吐量低于基线 (1 - max_slowdown) 倍或结果不再一致时视为退化
+    """
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    ok = True
+    for key, case in report["cases"].items():
+        base = baseline["cases"].get(key)
+        if base is None:
+            continue
+        ratio = case["bars_per_sec"] / base["bars_per_sec"]
+        if ratio < 1 - max_slowdown or not case["equivalent"]:
+            ok = False
+            print(f"退化：{key} 吞吐量为基线的 {ratio:.0%}，结果一致：{case['equivalent']}")
+    if ok:
+        print("与基线相比没有发现退化")
+    return ok
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="回测引擎基准测试")
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="quick")
+    parser.add_argument("--sizes", type=int, nargs="+", help="自定义K线数，覆盖 --preset")
+    parser.add_argument("--repeat", type=int, default=3, help="每个用例重复次数，取最好成绩")
+    parser.add_argument("--no-memory", action="store_true", help="不统计峰值内存")
+    parser.add_argument("--output", help="把完整结果写入 JSON 文件")
+    parser.add_argument("--save-baseline", help="把本次结果保存为基线")
+    parser.add_argument("--compare", help="与基线文件对比")
+    parser.add_argument("--max-slowdown", type=float, default=0.2, help="允许的最大变慢比例，默认 20%%")
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(args.sizes or PRESETS[args.preset], args.repeat, not args.no_memory)
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.compare:
+        return 0 if compare_with_baseline(report, args.compare, args.max_slowdown) else 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
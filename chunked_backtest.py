@@ -0,0 +1,180 @@
+"""
+分块（out-of-core）回测
+从 CSV 或 Parquet 文件按块读取真实股价，块与块之间接续均线所需的累加和尾部、
+上一根K线的均线差值、持仓状态和绩效累计量，内存中任何时候只有一块数据
+"""
+import math
+import os
+from typing import Iterator, Dict, Any, Optional
+
+import numpy as np
+import pandas as pd
+
+from backtest_core import TRADING_DAYS_PER_YEAR, crossover_signal_np, position_kernel_chunk
+
+
+def iter_price_chunks(path: str, price_column: str = 'close', chunksize: int = 1_000_000) -> Iterator[np.ndarray]:
+    """
+    按块读取收盘价列，支持 .csv 和 .parquet
+    Parquet 需要安装 pyarrow
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.parquet':
+        try:
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("读取 Parquet 文件需要安装 pyarrow：pip install pyarrow") from e
+        parquet_file = pq.ParquetFile(path)
+        for batch in parquet_file.iter_batches(batch_size=chunksize, columns=[price_column]):
+            yield batch.column(0).to_numpy(zero_copy_only=False).astype(np.float64, copy=False)
+    else:
+        for chunk in pd.read_csv(path, usecols=[price_column], chunksize=chunksize):
+            yield chunk[price_column].to_numpy(dtype=np.float64)
+
+
+class ChunkedBacktest:
+    """
+    可以一块一块喂数据的回测
+    均线用全局累加和计算，并把累加和的尾部带到下一块，所以均线、交易信号和持仓与一次性在内存中
+    计算（backtest_core.backtest_np）逐位相同；收益和波动率按块累计，与整体计算只差浮点舍入误差
+    """
+    def __init__(self, stop_loss_threshold=-0.05, risk_free_rate=0.03, ma5_window=5, ma20_window=20,
+                 periods_per_year=TRADING_DAYS_PER_YEAR):
+        self.stop_loss_threshold = stop_loss_threshold
+        self.risk_free_rate = risk_free_rate
+        self.ma5_window = ma5_window
+        self.ma20_window = ma20_window
+        self.periods_per_year = periods_per_year      # 每年K线数，分钟线数据需按周期换算
+
+        # 跨块接续的状态
+        self.csum_tail = np.zeros(1)                # 累加和的尾部（开头是 0）
+        self.prev_diff = np.nan                     # 上一块最后一根K线的均线差值
+        self.prev_price = None                      # 上一块最后一根K线的收盘价
+        self.holding = False
+        self.entry_price = np.nan
+
+        # 绩效累计量
+        self.day_count = 0
+        self.strategy_growth = 1.0
+        self.benchmark_growth = 1.0
+        self.return_count = 0
+        self.return_mean = 0.0
+        self.return_m2 = 0.0
+
+    def _rolling_mean(self, csum: np.ndarray, offset: int, window: int) -> np.ndarray:
+        # csum[i] 是全局第 (offset + i) 个累加和，本块第 k 根K线对应 csum[len(csum_tail) + k]
+        n = csum.shape[0] - self.csum_tail.shape[0]
+        ma = np.full(n, np.nan)
+        ends = np.arange(self.csum_tail.shape[0], csum.shape[0])    # 本块每根K线的累加和下标
+        starts = ends - window
+        valid = starts + offset >= 0
+        ma[valid] = (csum[ends[valid]] - csum[starts[valid]]) / window
+        return ma
+
+    def process_chunk(self, price: np.ndarray) -> Dict[str, np.ndarray]:
+        """
+        处理一块收盘价，返回这一块的交易信号和持仓，调用方可以直接写盘
+        """
+        price = np.asarray(price, dtype=np.float64)
+        if price.shape[0] == 0:
+            return {"trade_signal": price.copy(), "position": price.copy()}
+
+        # 从上一块最后一个累加和继续顺序累加，与整体 np.cumsum 结果逐位一致
+        tail_len = self.csum_tail.shape[0]
+        csum = np.concatenate((self.csum_tail, np.cumsum(np.concatenate(([self.csum_tail[-1]], price)))[1:]))
+        offset = self.day_count + 1 - tail_len      # csum[0] 在全局累加和中的下标
+        ma_diff = (self._rolling_mean(csum, offset, self.ma5_window)
+                   - self._rolling_mean(csum, offset, self.ma20_window))
+
+        # 把上一块最后的均线差值放在前面，金叉死叉才能跨块判断
+        signal = crossover_signal_np(np.concatenate(([self.prev_diff], ma_diff)))[1:]
+        trade_signal, _, position, self.holding, self.entry_price = position_kernel_chunk(
+            price, signal, self.stop_loss_threshold, self.holding, self.entry_price)
+
+        # 收益率同样要接上上一块最后的收盘价
+        if self.prev_price is None:
+            daily_return = price[1:] / price[:-1] - 1
+            strategy_return = daily_return * position[1:]
+        else:
+            prev = np.concatenate(([self.prev_price], price[:-1]))
+            daily_return = price / prev - 1
+            strategy_return = daily_return * position
+        self._update_performance(daily_return, strategy_return)
+
+        self.day_count += price.shape[0]
+        self.prev_diff = ma_diff[-1]
+        self.prev_price = price[-1]
+        self.csum_tail = csum[-(max(self.ma5_window, self.ma20_window) + 1):]
+        return {"trade_signal": trade_signal, "position": position}
+
+    def _update_performance(self, daily_return: np.ndarray, strategy_return: np.ndarray) -> None:
+        n = strategy_return.shape[0]
+        if n == 0:
+            return
+        self.benchmark_growth *= np.prod(1 + daily_return)
+        self.strategy_growth *= np.prod(1 + strategy_return)
+
+        # 合并两组数据的均值和平方差之和（Welford / Chan 并行公式）
+        chunk_mean = strategy_return.mean()
+        chunk_m2 = ((strategy_return - chunk_mean) ** 2).sum()
+        total = self.return_count + n
+        delta = chunk_mean - self.return_mean
+        self.return_mean += delta * n / total
+        self.return_m2 += chunk_m2 + delta ** 2 * self.return_count * n / total
+        self.return_count = total
+
+    def results(self) -> Dict[str, Any]:
+        """
+        当前为止的绩效，口径与 calculate_performance 一致
+        """
+        annual_strategy_return = self.strategy_growth ** (self.periods_per_year / self.day_count) - 1
+        if self.return_count > 1:
+            annual_volatility = math.sqrt(self.return_m2 / (self.return_count - 1)) * math.sqrt(self.periods_per_year)
+        else:
+            annual_volatility = math.nan
+        if annual_volatility != 0 and not math.isnan(annual_volatility):
+            sharpe_ratio = (annual_strategy_return - self.risk_free_rate) / annual_volatility
+        else:
+            sharpe_ratio = 0
+        return {
+            "day_count": self.day_count,
+            "total_benchmark_return": self.benchmark_growth - 1,
+            "total_strategy_return": self.strategy_growth - 1,
+            "annual_strategy_return": annual_strategy_return,
+            "annual_volatility": annual_volatility,
+            "sharpe_ratio": sharpe_ratio,
+        }
+
+
+def run_chunked_backtest(path: str, price_column: str = 'close', chunksize: int = 1_000_000,
+                         stop_loss_threshold=-0.05, risk_free_rate=0.03, ma5_window=5, ma20_window=20,
+                         output_path: Optional[str] = None,
+                         periods_per_year=TRADING_DAYS_PER_YEAR) -> Dict[str, Any]:
+    """
+    对一个股价文件做分块回测
+     output_path: 可选，把每根K线的交易信号和持仓按块追加写入这个 CSV
+     periods_per_year: 每年K线数，分钟线等由K线周期换算（见 timeframe_pyramid.bars_per_year）
+    """
+    backtest = ChunkedBacktest(stop_loss_threshold, risk_free_rate, ma5_window, ma20_window, periods_per_year)
+    first_chunk = True
+    for price in iter_price_chunks(path, price_column, chunksize):
+        chunk_result = backtest.process_chunk(price)
+        if output_path is not None:
+            pd.DataFrame({'交易信号': chunk_result["trade_signal"], '最终持仓状态': chunk_result["position"]}).to_csv(
+                output_path, mode='w' if first_chunk else 'a', header=first_chunk, index=False)
+        first_chunk = False
+    return backtest.results()
+
+
+def main():
+    import sys
+    if len(sys.argv) < 2:
+        print("用法：python chunked_backtest.py 股价文件.csv|.parquet [收盘价列名]")
+        return
+    price_column = sys.argv[2] if len(sys.argv) > 2 else 'close'
+    for name, value in run_chunked_backtest(sys.argv[1], price_column).items():
+        print(f"{name}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,18 @@
 
 import pandas as pd  
 import numpy as np   
-import matplotlib.pyplot as plt  
 import time  
 
+from backtest_core import position_kernel
+from plot_utils import get_pyplot, lttb_indices
+
+SAVE_PATH = None          # 设为图片路径（如 'result.png'）时不弹窗口，直接渲染到文件，适合服务器上跑
+MAX_PLOT_POINTS = 2000    # 折线最多画的点数，数据更长时先用 LTTB 降采样
+
 # 记录开始时间
 start_time = time.time()
 
-# 保证中文显示
-plt.rcParams['font.sans-serif'] = ['SimHei']
-plt.rcParams['axes.unicode_minus'] = False
+# 中文显示的字体设置移到 get_pyplot 里，画图前才导入 matplotlib
 
 
 # 生成1年交易日  获取交易日数量
@@ -68,6 +71,7 @@ sell_condition = (stock_df['均线差值'].shift(1) > 0) & (stock_df['均线差
 stock_df.loc[sell_condition, '交易信号'] = 0  # 0卖出
 
 
+'''  #原止损部分：买入价格一直向前填充，卖出后也不会清空，止损也不会真正重置持仓
 # 创建买入价列，初始为空
 stock_df['买入价格'] = np.nan
 
@@ -91,7 +95,16 @@ stock_df.loc[stop_loss_condition, '交易信号'] = 0
 
 #确定最终持仓状态（基础填充）
 stock_df['最终持仓状态'] = stock_df['交易信号'].fillna(method='ffill').fillna(0)
-
+'''
+# 优化：用持仓状态机单次遍历 空仓遇金叉开仓，死叉或止损平仓，平仓后等下一次金叉再入场
+stop_loss_threshold = -0.05
+trade_signal, entry_price, position = position_kernel(
+    stock_df['股票收盘价'].to_numpy(), stock_df['交易信号'].to_numpy(), stop_loss_threshold)
+stock_df['交易信号'] = trade_signal          # 实际发生的买卖点（含止损卖出）
+stock_df['买入价格'] = entry_price
+stock_df['浮亏比例'] = (stock_df['股票收盘价'] - stock_df['买入价格']) / stock_df['买入价格']
+stock_df['最终持仓状态'] = position
+''
 
 # 关于夏普比率的数学内容
 # 夏普比率 = (年化策略收益 - 无风险收益率) / 年化策略波动率
@@ -131,8 +144,8 @@ else:
 
 # 计算基准收益（买入持有）
 total_benchmark_return = (1 + stock_df['股票日收益率']).prod() - 1
-# 计算策略最终收益
-total_strategy_return_final = (1 + stock_df['策略日收益']).prod() - 1
+# 计算策略最终收益  优化：直接复用上面算过的累乘结果，不再重复累乘
+total_strategy_return_final = total_strategy_return - 1
 
 # 基础输出（易读格式）
 print("="*50)
@@ -145,12 +158,19 @@ print(f"策略年化波动率：{annual_volatility:.2%}")
 print(f"策略夏普比率：{sharpe_ratio:.2f}")  
 
 
+# 优化：画图时才导入 matplotlib，长序列降采样后再画折线
+plt = get_pyplot(headless=SAVE_PATH is not None)
+if len(stock_df) > MAX_PLOT_POINTS:
+    line_df = stock_df.iloc[lttb_indices(stock_df['股票收盘价'].to_numpy(), MAX_PLOT_POINTS)]
+else:
+    line_df = stock_df
+
 # 创建指定大小画布
 plt.figure(figsize=(10, 6))
 # 画股价和均线（plot语句）
-plt.plot(stock_df['股票收盘价'], label='股票收盘价', color='blue')
-plt.plot(stock_df['5日均线价格'], label='5日均线', color='red')
-plt.plot(stock_df['20日均线价格'], label='20日均线', color='green')
+plt.plot(line_df['股票收盘价'], label='股票收盘价', color='blue')
+plt.plot(line_df['5日均线价格'], label='5日均线', color='red')
+plt.plot(line_df['20日均线价格'], label='20日均线', color='green')
 # 标记买入/卖出点（scatter语句）
 plt.scatter(stock_df[stock_df['交易信号']==1].index, 
             stock_df[stock_df['交易信号']==1]['股票收盘价'], 
@@ -173,6 +193,10 @@ end_time = time.time()
 total_run_time = end_time - start_time
 print(f"\n程序运行总耗时：{total_run_time:.2f} 秒")
 
-plt.show()           
+if SAVE_PATH is not None:
+    plt.savefig(SAVE_PATH, dpi=100, bbox_inches='tight')
+    plt.close()
+else:
+    plt.show()
 #if __name__ == "__main__":
  #   main()
\ No newline at end of file
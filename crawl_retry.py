@@ -0,0 +1,226 @@
+"""
+爬虫请求的重试策略和熔断器
+RetryPolicy：指数退避 + 随机抖动，遵守服务器返回的 Retry-After
+CircuitBreaker：某个域名连续失败达到阈值后熔断，一段时间内不再请求它，之后放一个试探请求，成功则恢复
+同步（requests + 线程池）和异步（aiohttp）爬虫共用，熔断器是线程安全的
+"""
+import asyncio
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+
+# 一次请求尝试的结果：(状态码, 响应头, 内容)
+AttemptResult = Tuple[int, Any, Any]
+
+
+class CircuitOpenError(Exception):
+    """
+    域名处于熔断状态，请求没有发出
+    """
+
+
+class RetryPolicy:
+    """
+    重试策略
+    """
+    def __init__(self, max_attempts: int = 4, base_delay: float = 0.5, max_delay: float = 30.0,
+                 retry_statuses=(429, 500, 502, 503, 504), retry_exceptions: Tuple[type, ...] = (OSError,),
+                 max_retry_after: float = 120.0):
+        """
+         max_attempts: 最多尝试次数（含第一次）
+         base_delay / max_delay: 第 n 次重试前最多等待 base_delay * 2**n 秒，不超过 max_delay
+         retry_statuses: 需要重试的状态码（限流和服务端临时错误）
+         retry_exceptions: 需要重试的异常类型（连接失败、超时等）
+         max_retry_after: Retry-After 的上限，服务器要求等更久时按上限等待
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_statuses = frozenset(retry_statuses)
+        self.retry_exceptions = tuple(retry_exceptions)
+        self.max_retry_after = max_retry_after
+
+    def backoff(self, attempt: int) -> float:
+        # full jitter：在 [0, 上限] 里均匀取值，避免大量请求在同一时刻一起重试
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def delay_for(self, attempt: int, headers: Any = None) -> float:
+        """
+        第 attempt 次失败后（从 0 开始）应等待的秒数；响应带 Retry-After 时至少等这么久
+        """
+        delay = self.backoff(attempt)
+        retry_after = parse_retry_after(headers.get('Retry-After') if headers is not None else None)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_retry_after))
+        return delay
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Retry-After 可以是秒数，也可以是 HTTP 日期；无法解析时返回 None
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """
+    单个域名的熔断器
+    closed（正常） -> 连续失败 failure_threshold 次 -> open（拒绝请求）
+    -> 过了 recovery_timeout 秒 -> half_open（只放一个试探请求） -> 成功 closed / 失败 open
+    """
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.recovery_timeout:
+                self.state = 'half_open'
+                self._trial_running = False
+            if self.state == 'closed':
+                return True
+            if self.state == 'half_open' and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+            self._trial_running = False
+
+    def record_cancelled(self) -> None:
+        """
+        请求被取消或中断（KeyboardInterrupt、CancelledError 等），不能说明域名有问题：不计失败，只释放试探名额
+        """
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+            self._trial_running = False
+
+
+class HostCircuitBreakers:
+    """
+    按域名分别熔断
+    """
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get(self, url: str) -> CircuitBreaker:
+        host = urlsplit(url).hostname or ''
+        with self._lock:
+            breaker = self.breakers.get(host)
+            if breaker is None:
+                breaker = self.breakers[host] = CircuitBreaker(self.failure_threshold, self.recovery_timeout)
+            return breaker
+
+
+def retry_sync(attempt: Callable[[], AttemptResult], url: str, policy: RetryPolicy,
+               breakers: Optional[HostCircuitBreakers] = None) -> AttemptResult:
+    """
+    同步重试：attempt() 发一次请求并返回 (状态码, 响应头, 内容)
+    返回最后一次尝试的结果（重试用尽时可能仍是失败的状态码）；最后一次仍抛异常时向上抛出，
+    熔断时抛出 CircuitOpenError
+    """
+    breaker = breakers.get(url) if breakers is not None else None
+    for n in range(policy.max_attempts):
+        if breaker is not None and not breaker.allow():
+            raise CircuitOpenError(f"{urlsplit(url).hostname} 已熔断，暂停请求")
+        headers = None
+        try:
+            result = attempt()
+        except policy.retry_exceptions:
+            if breaker is not None:
+                breaker.record_failure()
+            if n == policy.max_attempts - 1:
+                raise
+        except Exception:
+            # 其他异常不重试，但要让熔断器知道这次试探失败了
+            if breaker is not None:
+                breaker.record_failure()
+            raise
+        except BaseException:
+            # 取消、Ctrl+C、退出不是域名的问题，不计入熔断
+            if breaker is not None:
+                breaker.record_cancelled()
+            raise
+        else:
+            if result[0] not in policy.retry_statuses:
+                if breaker is not None:
+                    breaker.record_success()
+                return result
+            if breaker is not None:
+                breaker.record_failure()
+            if n == policy.max_attempts - 1:
+                return result
+            headers = result[1]
+        time.sleep(policy.delay_for(n, headers))
+    raise AssertionError("max_attempts 必须至少为 1")
+
+
+async def retry_async(attempt: Callable[[], Awaitable[AttemptResult]], url: str, policy: RetryPolicy,
+                      breakers: Optional[HostCircuitBreakers] = None) -> AttemptResult:
+    """
+    retry_sync 的异步版本，等待时用 asyncio.sleep，不阻塞事件循环
+    """
+    breaker = breakers.get(url) if breakers is not None else None
+    for n in range(policy.max_attempts):
+        if breaker is not None and not breaker.allow():
+            raise CircuitOpenError(f"{urlsplit(url).hostname} 已熔断，暂停请求")
+        headers = None
+        try:
+            result = await attempt()
+        except policy.retry_exceptions:
+            if breaker is not None:
+                breaker.record_failure()
+            if n == policy.max_attempts - 1:
+                raise
+        except Exception:
+            # 其他异常不重试，但要让熔断器知道这次试探失败了
+            if breaker is not None:
+                breaker.record_failure()
+            raise
+        except BaseException:
+            # 取消、Ctrl+C、退出不是域名的问题，不计入熔断
+            if breaker is not None:
+                breaker.record_cancelled()
+            raise
+        else:
+            if result[0] not in policy.retry_statuses:
+                if breaker is not None:
+                    breaker.record_success()
+                return result
+            if breaker is not None:
+                breaker.record_failure()
+            if n == policy.max_attempts - 1:
+                return result
+            headers = result[1]
+        await asyncio.sleep(policy.delay_for(n, headers))
+    raise AssertionError("max_attempts 必须至少为 1")
@@ -0,0 +1,161 @@
+"""
+网页的磁盘缓存（条件请求）
+每个网址存一份：网页内容、ETag、Last-Modified，以及各爬虫解析出的结果
+再次抓取时带上 If-None-Match / If-Modified-Since，服务器返回 304 说明网页没变，直接用缓存的解析结果，
+不再下载和解析；超过最长保存时间或总大小超过上限时删除最久没有验证过的
+同步和异步爬虫共用；每条缓存是一个独立的 JSON 文件，写入时先写临时文件再改名，多线程同时读写也安全
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Mapping, Optional
+
+
+class HttpCache:
+    """
+    按网址缓存网页和解析结果
+    """
+    def __init__(self, cache_dir: str = '.http_cache', max_age: float = 7 * 24 * 3600,
+                 max_bytes: int = 200 * 1024 * 1024, evict_every: int = 100):
+        """
+         cache_dir: 缓存目录
+         max_age: 最长保存秒数（从最后一次下载或 304 验证算起），超过的缓存视为不存在
+         max_bytes: 缓存总大小上限，超过时删除最久没有验证过的
+         evict_every: 每写入多少次检查一次总大小（检查要遍历目录）
+        """
+        self.cache_dir = cache_dir
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.evict_every = evict_every
+        self.hits = 0               # 304，用了缓存
+        self.misses = 0             # 200，重新下载了整个网页
+        self._puts = 0
+        self._lock = threading.Lock()
+
+    def _path(self, url: str) -> str:
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, key[:2], key + '.json')
+
+    def get(self, url: str) -> Optional[Dict[str, Any]]:
+        """
+        返回缓存条目 {"url", "etag", "last_modified", "body", "parsed"}，没有或已过期时返回 None
+        """
+        path = self._path(url)
+        try:
+            if time.time() - os.stat(path).st_mtime > self.max_age:
+                os.unlink(path)
+                return None
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def conditional_headers(entry: Optional[Dict[str, Any]]) -> Dict[str, str]:
+        """
+        由缓存条目生成条件请求头
+        """
+        headers = {}
+        if entry is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def put(self, url: str, body: str, response_headers: Mapping[str, str],
+            parsed_key: Optional[str] = None, parsed: Any = None) -> None:
+        """
+        保存一次 200 响应；没有 ETag 和 Last-Modified 的响应无法做条件请求，不保存
+         parsed_key / parsed: 某个爬虫对这个网页的解析结果（需要能 JSON 序列化），304 时直接复用
+        """
+        etag = response_headers.get('ETag')
+        last_modified = response_headers.get('Last-Modified')
+        with self._lock:
+            self.misses += 1
+        if not etag and not last_modified:
+            return
+        entry = {"url": url, "etag": etag, "last_modified": last_modified, "body": body,
+                 "parsed": {parsed_key: parsed} if parsed_key is not None else {}}
+        self._write(url, entry)
+
+        with self._lock:
+            self._puts += 1
+            need_evict = self._puts % self.evict_every == 0
+        if need_evict:
+            self.evict()
+
+    def revalidated(self, url: str, entry: Dict[str, Any], response_headers: Mapping[str, str],
+                    parsed_key: Optional[str] = None, parsed: Any = None) -> None:
+        """
+        收到 304 后调用：刷新最后验证时间（和服务器给的新 ETag），可顺便补上这个爬虫的解析结果
+        """
+        with self._lock:
+            self.hits += 1
+        changed = False
+        for name, header in (('etag', 'ETag'), ('last_modified', 'Last-Modified')):
+            value = response_headers.get(header)
+            if value and value != entry.get(name):
+                entry[name] = value
+                changed = True
+        if parsed_key is not None and parsed_key not in entry['parsed']:
+            entry['parsed'][parsed_key] = parsed
+            changed = True
+        if changed:
+            self._write(url, entry)
+        else:
+            try:
+                os.utime(self._path(url))           # 修改时间即最后验证时间
+            except FileNotFoundError:
+                pass
+
+    def _write(self, url: str, entry: Dict[str, Any]) -> None:
+        path = self._path(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def evict(self) -> None:
+        """
+        删除过期的缓存，并在总大小超过上限时从最久没验证过的开始删
+        """
+        entries = []
+        now = time.time()
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith('.json'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                    if now - stat.st_mtime > self.max_age:
+                        os.unlink(path)
+                        continue
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self) -> None:
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith('.json'):
+                    os.unlink(os.path.join(root, name))
@@ -0,0 +1,103 @@
+"""
+同步爬虫的 HTTP 连接池
+直接调用 requests.get 时每个请求都新建一个 Session，连接用完即关，线程池里每个请求都要重新做 TCP（和 TLS）握手
+PooledSessions 给每个工作线程一个 requests.Session（Session 本身不保证线程安全），这些 Session 挂同一个 HTTPAdapter，
+共用按域名划分的 urllib3 连接池（连接池是线程安全的），请求结束后连接放回池里，后面的请求直接复用
+同时开启 keep-alive 和压缩，并从连接池读出请求数与新建连接数，统计连接复用率
+用完后调用 close()，或用 with 语句管理
+"""
+import threading
+from typing import Any, Dict, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+def _accept_encoding() -> str:
+    # urllib3 装了 brotli 时才能解压 br
+    try:
+        import brotli  # noqa: F401
+        return 'gzip, deflate, br'
+    except ImportError:
+        return 'gzip, deflate'
+
+
+class PooledSessions:
+    """
+    按线程分配的 Session，共用一组连接池
+    """
+    def __init__(self, pool_connections: int = 10, pool_maxsize: int = 10, pool_block: bool = False,
+                 keep_alive: bool = True, compress: bool = True, headers: Optional[Dict[str, str]] = None):
+        """
+         pool_connections: 保留连接池的域名数，超过时最久没用的域名的连接池被关闭
+         pool_maxsize: 每个域名最多保留的空闲连接数，一般设为线程数
+         pool_block: 连接数达到 pool_maxsize 时是否等待空闲连接（False 时临时多建连接，用完不放回）
+         keep_alive: False 时每个请求带 Connection: close，不复用连接（用于对比）
+         compress: 是否请求压缩的响应（gzip / deflate，装了 brotli 时加 br），False 时要求不压缩
+         headers: 每个请求都带的请求头，如 User-Agent
+        """
+        self.adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                                   pool_block=pool_block, max_retries=0)      # 重试由 crawl_retry 负责
+        self.headers = dict(headers or {})
+        self.headers['Accept-Encoding'] = _accept_encoding() if compress else 'identity'
+        self.headers['Connection'] = 'keep-alive' if keep_alive else 'close'
+        self._local = threading.local()
+        self._sessions: List[requests.Session] = []
+        self._lock = threading.Lock()
+
+    def session(self) -> requests.Session:
+        """
+        当前线程的 Session，第一次调用时创建
+        """
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.headers.update(self.headers)
+            session.mount('http://', self.adapter)
+            session.mount('https://', self.adapter)
+            self._local.session = session
+            with self._lock:
+                self._sessions.append(session)
+        return session
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.session().get(url, **kwargs)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        各域名的请求数、新建连接数和连接复用率（按当前保留的连接池统计，被关闭的连接池不计入）
+        """
+        pools = self.adapter.poolmanager.pools
+        requests_count = connections = 0
+        for key in pools.keys():
+            try:
+                pool = pools[key]
+            except KeyError:        # 统计时被其他线程关闭了
+                continue
+            requests_count += pool.num_requests
+            connections += pool.num_connections
+        reused = max(requests_count - connections, 0)
+        return {
+            "requests": requests_count,
+            "new_connections": connections,
+            "reused": reused,
+            "reuse_rate": reused / requests_count if requests_count else 0.0,
+            "sessions": len(self._sessions),
+        }
+
+    def close(self) -> None:
+        """
+        关闭所有线程的 Session 和连接池；之后再请求会重新建立
+        """
+        with self._lock:
+            sessions, self._sessions = self._sessions, []
+        for session in sessions:
+            session.close()
+        self.adapter.close()
+        self._local = threading.local()
+
+    def __enter__(self) -> 'PooledSessions':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
@@ -0,0 +1,64 @@
+"""
+前缀和指标缓存
+同一条收盘价只算一次累加和，之后任意窗口的均线都由它 O(n) 得到，
+参数扫描时不用再为 2~250 的每个窗口重新做一遍 rolling
+"""
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+
+from backtest_core import cumsum_np, rolling_mean_from_csum
+
+
+class IndicatorCache:
+    """
+    按股价数组本身（对象身份）缓存累加和，超过内存上限时淘汰最久未使用的
+    注意：缓存不会察觉对数组的原地修改，修改股价后请调用 clear()
+    """
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024):
+        """
+         max_bytes: 缓存的累加和数组总字节数上限，默认 256MB
+        """
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()                # id(股价) -> (股价弱引用, 累加和)
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def cumsum(self, price: np.ndarray) -> np.ndarray:
+        key = id(price)
+        entry = self.entries.get(key)
+        if entry is not None and entry[0]() is price:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry[1]
+
+        self.misses += 1
+        csum = cumsum_np(price)
+        self._evict(key)
+        # 股价数组被回收后自动移除对应缓存，id 不会被错认
+        ref = weakref.ref(price, lambda _, key=key: self._evict(key))
+        self.entries[key] = (ref, csum)
+        self.current_bytes += csum.nbytes
+
+        # LRU 淘汰，至少保留刚放进去的这一条
+        while self.current_bytes > self.max_bytes and len(self.entries) > 1:
+            old_key = next(iter(self.entries))
+            self._evict(old_key)
+        return csum
+
+    def sma(self, price: np.ndarray, window: int) -> np.ndarray:
+        """
+        滚动均值，结果与 backtest_core.rolling_mean_np 逐位相同
+        """
+        return rolling_mean_from_csum(self.cumsum(price), window)
+
+    def _evict(self, key: int) -> None:
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.current_bytes -= entry[1].nbytes
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.current_bytes = 0
@@ -0,0 +1,183 @@
+"""
+指标计算图
+策略声明自己需要的指标节点（均线、差值、平移、金叉死叉、止损持仓），节点按 (运算, 参数, 输入节点) 去重，
+同一条股价上的相同节点只算一次，在这条股价上评估的所有策略共享
+例如几十个均线策略变体共用同一批 SMA，同一组均线下不同止损阈值共用交易信号
+"""
+from typing import Dict, Any, Iterable, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from backtest_core import TRADING_DAYS_PER_YEAR, position_kernel, performance_np
+from indicator_cache import IndicatorCache
+
+
+# 节点就是可哈希的元组：(运算名, 参数..., 输入节点...)，相同的元组即同一个节点
+PRICE = ('price',)
+
+
+class IndicatorGraph:
+    """
+    绑定一条股价（一维或 交易日 × 股票 的二维数组）的指标图，节点的值第一次用到时计算并缓存
+    """
+    def __init__(self, price: np.ndarray, indicator_cache: Optional[IndicatorCache] = None):
+        """
+         price: 股价数组
+         indicator_cache: 可选的 IndicatorCache，多个图（如多个进程内的任务）可以共用累加和
+        """
+        self.price = np.asarray(price, dtype=np.float64)
+        self.indicator_cache = indicator_cache if indicator_cache is not None else IndicatorCache()
+        self.values = {PRICE: self.price}           # 节点 -> 计算结果
+        self.price_finite = bool(np.isfinite(self.price).all())
+        self.hits = 0
+        self.misses = 0
+
+    # ---- 声明节点 ----
+    @staticmethod
+    def sma(window: int, source: Tuple = PRICE) -> Tuple:
+        return ('sma', int(window), source)
+
+    @staticmethod
+    def ema(span: int, source: Tuple = PRICE) -> Tuple:
+        return ('ema', int(span), source)
+
+    @staticmethod
+    def diff(left: Tuple, right: Tuple) -> Tuple:
+        return ('diff', left, right)
+
+    @staticmethod
+    def shift(source: Tuple, periods: int = 1) -> Tuple:
+        return ('shift', int(periods), source)
+
+    @staticmethod
+    def crossover(source: Tuple) -> Tuple:
+        # source 上穿 0 为金叉（1），下穿 0 为死叉（0），与 crossover_signal_np 相同
+        return ('crossover', source)
+
+    @staticmethod
+    def position(signal: Tuple, stop_loss_threshold: float) -> Tuple:
+        # 值为 position_kernel 的 (交易信号, 买入价格, 最终持仓状态)
+        return ('position', float(stop_loss_threshold), signal)
+
+    # ---- 求值 ----
+    def evaluate(self, node: Tuple):
+        """
+        返回节点的值，依赖的节点按需先算好；已经算过的直接返回缓存
+        """
+        value = self.values.get(node)
+        if value is not None:
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = self._compute(node)
+        self.values[node] = value
+        return value
+
+    def _compute(self, node: Tuple):
+        op = node[0]
+        if op == 'sma':
+            _, window, source = node
+            if source == PRICE and self.price_finite:
+                return self.indicator_cache.sma(self.price, window)     # 各窗口共用一次累加和
+            # 累加和里一个 NaN 会污染之后所有的值，派生节点（含预热期的 NaN）按 rolling().mean() 计算：
+            # 窗口内有 NaN 时为 NaN，移出窗口后恢复
+            data = self.evaluate(source)
+            return pd.DataFrame(data.reshape(data.shape[0], -1)).rolling(window).mean() \
+                .to_numpy().reshape(data.shape)
+        if op == 'ema':
+            _, span, source = node
+            data = self.evaluate(source)
+            return pd.DataFrame(data.reshape(data.shape[0], -1)).ewm(span=span, adjust=False) \
+                .mean().to_numpy().reshape(data.shape)
+        if op == 'diff':
+            _, left, right = node
+            return self.evaluate(left) - self.evaluate(right)
+        if op == 'shift':
+            _, periods, source = node
+            data = self.evaluate(source)
+            shifted = np.full(data.shape, np.nan)
+            if periods >= 0:
+                shifted[periods:] = data[:data.shape[0] - periods]
+            else:
+                shifted[:periods] = data[-periods:]
+            return shifted
+        if op == 'crossover':
+            _, source = node
+            current, previous = self.evaluate(source), self.evaluate(self.shift(source))
+            signal = np.full(current.shape, np.nan)
+            # NaN 参与比较结果为 False，与 pandas 的 shift 比较一致
+            with np.errstate(invalid='ignore'):
+                signal[(previous < 0) & (current >= 0)] = 1
+                signal[(previous > 0) & (current <= 0)] = 0
+            return signal
+        if op == 'position':
+            _, stop_loss_threshold, signal = node
+            return position_kernel(self.price, self.evaluate(signal), stop_loss_threshold)
+        raise ValueError(f"未知的指标节点：{node}")
+
+    def release(self, node: Tuple) -> None:
+        """
+        丢掉一个节点的缓存值（之后用到时会重新计算），用于控制内存
+        """
+        if node != PRICE:
+            self.values.pop(node, None)
+
+    def clear(self) -> None:
+        self.values = {PRICE: self.price}
+
+    @property
+    def node_count(self) -> int:
+        return len(self.values) - 1
+
+
+def ma_strategy_nodes(ma5_window: int = 5, ma20_window: int = 20, stop_loss_threshold: float = -0.05,
+                      ma_type: str = 'sma') -> Dict[str, Tuple]:
+    """
+    均线金叉死叉+止损策略需要的节点；ma_type 为 'sma' 或 'ema'
+    """
+    if ma_type not in ('sma', 'ema'):
+        raise ValueError(f"ma_type 只能是 'sma' 或 'ema'，收到：{ma_type}")
+    ma = IndicatorGraph.sma if ma_type == 'sma' else IndicatorGraph.ema
+    ma_diff = IndicatorGraph.diff(ma(ma5_window), ma(ma20_window))
+    signal = IndicatorGraph.crossover(ma_diff)
+    return {
+        "ma_diff": ma_diff,
+        "signal": signal,
+        "position": IndicatorGraph.position(signal, stop_loss_threshold),
+    }
+
+
+def evaluate_strategies(price: np.ndarray, strategies: Iterable[Dict[str, Any]], risk_free_rate: float = 0.03,
+                        periods_per_year: float = TRADING_DAYS_PER_YEAR,
+                        graph: Optional[IndicatorGraph] = None) -> pd.DataFrame:
+    """
+    在同一条股价上评估多个均线策略变体，共享的指标节点只算一次
+     strategies: 每个元素是 ma_strategy_nodes 的参数字典，如 {"ma5_window": 5, "ma20_window": 20}
+     graph: 可选，传入已有的图以继续复用之前算过的节点
+    返回每个策略一行的绩效表（二维股价时每个指标为各股票的数组）
+    """
+    graph = graph if graph is not None else IndicatorGraph(price)
+    rows = []
+    for params in strategies:
+        nodes = ma_strategy_nodes(**params)
+        position = graph.evaluate(nodes["position"])[2]
+        row = dict(params)
+        row.update(performance_np(graph.price, position, risk_free_rate, periods_per_year))
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def main():
+    from backtest_core import generate_price_np
+    graph = IndicatorGraph(generate_price_np(252 * 10))
+    strategies = [{"ma5_window": fast, "ma20_window": slow, "stop_loss_threshold": stop, "ma_type": ma_type}
+                  for ma_type in ('sma', 'ema') for fast in (3, 5, 10) for slow in (20, 30, 60)
+                  for stop in (-0.03, -0.05, -0.08)]
+    result_df = evaluate_strategies(graph.price, strategies, graph=graph)
+    print(result_df.sort_values("sharpe_ratio", ascending=False).head(10).to_string(index=False))
+    print(f"\n{len(strategies)} 个策略，计算了 {graph.misses} 个节点，复用 {graph.hits} 次")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,59 +1,245 @@
 import asyncio
+import contextlib
+import time
 import aiohttp
-from bs4 import BeautifulSoup
-from typing import List, Dict, Any  
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from typing import List, Dict, Any, Optional
+from urllib.parse import urlsplit
+
+from crawl_retry import RetryPolicy, HostCircuitBreakers, retry_async
+from http_cache import HttpCache
+from movie_parser import parse_items
 
 
 TARGET_MOVIE_COUNT = 100    # 爬取的电影总数
 PRINT_COUNT = 50            # 打印展示的电影条数
 PAGE_SIZE = 25              # 豆瓣Top250每页固定显示25部
 MAX_TOTAL_PAGE = 10         # 豆瓣Top250总页数
+BASE_URL = 'https://movie.douban.com/top250'
+
+# 并发与限速
+MAX_IN_FLIGHT = 8           # 同时在途的请求数上限
+RATE_PER_HOST = 2.0         # 每个域名每秒最多发出的请求数（令牌桶补充速度）
+RATE_BURST = 4              # 令牌桶容量：允许的瞬时突发请求数
+
+# 连接池（TCPConnector）
+CONNECTOR_LIMIT = 100       # 连接池总连接数
+CONNECTOR_LIMIT_PER_HOST = 8    # 每个域名的最大连接数
+DNS_CACHE_TTL = 300         # DNS 解析结果缓存秒数
+KEEPALIVE_TIMEOUT = 30      # 空闲连接保持秒数，后续请求复用，不再重新握手
+REQUEST_TIMEOUT = 30        # 单个请求的总超时秒数
+
+# 重试与熔断：503、429、连接错误、超时按指数退避重试；某个域名连续失败太多次时暂停请求它
+RETRY_POLICY = RetryPolicy(max_attempts=4, base_delay=0.5, max_delay=30,
+                           retry_exceptions=(aiohttp.ClientError, asyncio.TimeoutError))
+CIRCUIT_BREAKERS = HostCircuitBreakers(failure_threshold=5, recovery_timeout=30)
+
+# 网页缓存：再次运行时发条件请求，未变化的网页（304）直接用上次的解析结果；设为 None 关闭缓存
+HTTP_CACHE: Optional[HttpCache] = HttpCache('.http_cache', max_age=7 * 24 * 3600, max_bytes=200 * 1024 * 1024)
+PARSED_KEY = 'title_score'  # 本爬虫解析结果在缓存中的键，与解析出的字段对应
+
+# 网页解析后端：'auto'（有 selectolax / lxml 时用它们，都没有时用 BeautifulSoup）、'selectolax'、'lxml'、
+# 'bs4_strainer'（只解析 div.item）、'bs4'（原来的 html.parser 整页解析）
+PARSER_BACKEND = 'auto'
+
+# 解析放到线程池或进程池里做，事件循环只负责收发网络数据
+PARSE_EXECUTOR = 'thread'   # 'thread'、'process'（多核并行，网页和结果要在进程间传递）或 'inline'（在事件循环里直接解析）
+PARSE_WORKERS = 4           # 解析用的线程数/进程数
+MAX_PENDING_PARSES = 8      # 已下载但还没解析完的网页数上限，解析跟不上时暂停读取新的网页正文
 
 # 请求头  这个头是我的浏览器复制来的
 headers = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
 }
 
-async def fetch_movies(session: aiohttp.ClientSession, start_num: int) -> List[Dict[str, Any]]:
+class TokenBucket:
+    """
+    令牌桶限速：每秒补充 rate 个令牌，最多攒 capacity 个，每个请求取走一个，没有令牌时排队等待
+    """
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()          # 等待的请求按先来后到依次取令牌
+
+    async def acquire(self) -> None:
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class HostRateLimiter:
+    """
+    每个域名一个令牌桶，不同网站之间互不影响
+    """
+    def __init__(self, rate: float = RATE_PER_HOST, burst: int = RATE_BURST):
+        self.rate = rate
+        self.burst = burst
+        self.buckets: Dict[str, TokenBucket] = {}
+
+    async def acquire(self, url: str) -> None:
+        host = urlsplit(url).hostname or ''
+        bucket = self.buckets.get(host)
+        if bucket is None:
+            bucket = self.buckets[host] = TokenBucket(self.rate, self.burst)
+        await bucket.acquire()
+
+
+class ParsePool:
+    """
+    把网页解析交给线程池或进程池，解析时事件循环仍能处理其他请求的响应
+    读取网页正文前先 acquire() 占一个名额，解析完 release()；名额用完时新的响应先不读正文，
+    已下载未解析的网页最多 max_pending 个，不会无限堆积
+    """
+    def __init__(self, kind: str = PARSE_EXECUTOR, max_workers: int = PARSE_WORKERS,
+                 max_pending: int = MAX_PENDING_PARSES):
+        if kind == 'thread':
+            self.executor: Optional[Executor] = ThreadPoolExecutor(max_workers)
+        elif kind == 'process':
+            self.executor = ProcessPoolExecutor(max_workers)
+        elif kind == 'inline':
+            self.executor = None
+        else:
+            raise ValueError(f"kind 只能是 'thread'、'process' 或 'inline'，收到：{kind}")
+        self.kind = kind
+        self.slots = asyncio.Semaphore(max_pending)
+        self.pending = 0
+        self.peak_pending = 0       # 同时等待解析的网页数的最大值
+
+    async def acquire(self) -> None:
+        await self.slots.acquire()
+        self.pending += 1
+        self.peak_pending = max(self.peak_pending, self.pending)
+
+    def release(self) -> None:
+        self.pending -= 1
+        self.slots.release()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self.release()
+
+    async def parse(self, html: str) -> List[Dict[str, Any]]:
+        if self.executor is None:
+            return parse_movies(html, PARSER_BACKEND)
+        # 解析后端显式传过去：进程池的子进程里模块级配置可能不是主进程改过的值
+        return await asyncio.get_running_loop().run_in_executor(self.executor, parse_movies, html, PARSER_BACKEND)
+
+    def close(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown()
+
+
+def make_session() -> aiohttp.ClientSession:
+    """
+    创建调优过连接池的会话：限制总连接数和单域名连接数，缓存 DNS，空闲连接保持一段时间供后续请求复用
+    """
+    connector = aiohttp.TCPConnector(limit=CONNECTOR_LIMIT, limit_per_host=CONNECTOR_LIMIT_PER_HOST,
+                                     ttl_dns_cache=DNS_CACHE_TTL, keepalive_timeout=KEEPALIVE_TIMEOUT)
+    return aiohttp.ClientSession(connector=connector, headers=headers,
+                                 timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT))
+
+
+async def fetch_movies(session: aiohttp.ClientSession, start_num: int,
+                       semaphore: Optional[asyncio.Semaphore] = None,
+                       limiter: Optional[HostRateLimiter] = None,
+                       parse_pool: Optional[ParsePool] = None) -> List[Dict[str, Any]]:
     
     """  
         session: 共享的异步HTTP会话对象
         start_num: 分页起始数（0,25,50...）
+        semaphore: 可选，限制同时在途的请求数（只管请求本身，解析时不占名额）
+        limiter: 可选，按域名限速
+        parse_pool: 可选，解析用的 ParsePool，不传时在事件循环里直接解析
     Returns:
         包含电影信息的列表，每个元素是字典：{"title": 电影名, "score": 评分}
     """
+    return await _fetch_movies(session, start_num, semaphore, limiter,
+                               parse_pool if parse_pool is not None else ParsePool('inline'))
+
 
-    url = f'https://movie.douban.com/top250?start={start_num}&filter='
+def parse_movies(html: str, backend: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    从一页网页中解析出电影名称和评分；backend 不传时用 PARSER_BACKEND
+    """
+    movie_list: List[Dict[str, Any]] = []
+    
+    # 每一部电影的容器 div.item 中取出的文本
+    for item in parse_items(html, backend or PARSER_BACKEND):
+        # 提取电影名称（排除外文）
+        title = item.title if item.title is not None else "未知名称"
+        if "/" in title:  # 过滤带/的外文名称
+            continue
+        
+        # 电影评分
+        score = item.score if item.score is not None else "0.0"
+        
+        # 组装电影的信息
+        movie_info = {"title": title, "score": score}
+        movie_list.append(movie_info)
+    return movie_list
+
+async def _fetch_movies(session: aiohttp.ClientSession, start_num: int,
+                        semaphore: Optional[asyncio.Semaphore], limiter: Optional[HostRateLimiter],
+                        parse_pool: ParsePool) -> List[Dict[str, Any]]:
+    url = f'{BASE_URL}?start={start_num}&filter='
     movie_list: List[Dict[str, Any]] = []  
     
+    # 有缓存时带上条件请求头，网页没变服务器会返回 304
+    # 缓存的读写（JSON 文件、定期遍历目录淘汰）都是阻塞的磁盘操作，放到线程里做，不卡住事件循环
+    entry = await asyncio.to_thread(HTTP_CACHE.get, url) if HTTP_CACHE is not None else None
+    request_headers = dict(headers, **HttpCache.conditional_headers(entry))
+    
+    # 一次请求尝试：每次重试都重新排队取在途名额和令牌，退避等待时不占名额
+    async def attempt():
+        async with semaphore if semaphore is not None else contextlib.nullcontext():
+            if limiter is not None:
+                await limiter.acquire(url)
+            async with session.get(url, headers=request_headers) as response:
+                if response.status != 200:
+                    return response.status, response.headers, None
+                # 先占解析名额再读正文：解析跟不上时在这里等，正文留在连接上不读进内存
+                await parse_pool.acquire()
+                try:
+                    html = await response.text()
+                except BaseException:
+                    parse_pool.release()
+                    raise
+                return response.status, response.headers, html
+
     try:
-        async with session.get(url, headers=headers) as response:
-            if response.status != 200:
-                print(f"Page {start_num//PAGE_SIZE + 1} 请求失败，状态码：{response.status}")
-                return movie_list
-            
-            html = await response.text()
-            soup = BeautifulSoup(html, 'html.parser')
-            
-            # 定位每一部电影的容器
-            movie_items = soup.find_all('div', class_='item')
-            for item in movie_items:
-                # 提取电影名称（排除外文）
-                title_movie = item.find('span', class_='title')
-                title = title_movie.string if title_movie else "未知名称"
-                if "/" in title:  # 过滤带/的外文名称
-                    continue
-                
-                # 电影评分
-                score_movie = item.find('span', class_='rating_num')
-                score = score_movie.string if score_movie else "0.0"
-                
-                # 组装电影的信息
-                movie_info = {"title": title, "score": score}
-                movie_list.append(movie_info)
-                
-            print(f"Page {start_num//PAGE_SIZE + 1} 爬取完成，共{len(movie_list)}部电影")
-            
+        status, response_headers, html = await retry_async(attempt, url, RETRY_POLICY, CIRCUIT_BREAKERS)
+        if status == 304 and entry is not None:
+            # 网页没变：直接用缓存的解析结果，没有时解析缓存的网页
+            movie_list = entry['parsed'].get(PARSED_KEY)
+            if movie_list is None:
+                async with parse_pool:
+                    movie_list = await parse_pool.parse(entry['body'])
+            await asyncio.to_thread(HTTP_CACHE.revalidated, url, entry, response_headers, PARSED_KEY, movie_list)
+            print(f"Page {start_num//PAGE_SIZE + 1} 未变化，使用缓存，共{len(movie_list)}部电影")
+            return movie_list
+        if status != 200:
+            print(f"Page {start_num//PAGE_SIZE + 1} 请求失败，状态码：{status}")
+            return movie_list
+
+        try:
+            movie_list = await parse_pool.parse(html)
+        finally:
+            parse_pool.release()
+        if HTTP_CACHE is not None:
+            await asyncio.to_thread(HTTP_CACHE.put, url, html, response_headers, PARSED_KEY, movie_list)
+        print(f"Page {start_num//PAGE_SIZE + 1} 爬取完成，共{len(movie_list)}部电影")
+        
     except Exception as e:
         print(f"Page {start_num//PAGE_SIZE + 1} 爬取出错：{str(e)}")
     
@@ -67,17 +253,24 @@ async def main() -> List[Dict[str, Any]]:
     need_page = min((TARGET_MOVIE_COUNT + PAGE_SIZE - 1) // PAGE_SIZE, MAX_TOTAL_PAGE)
     start_nums = [i * PAGE_SIZE for i in range(need_page)]
     
-    async with aiohttp.ClientSession() as session:
-        # 生成对应页数的爬取任务
-        tasks = [fetch_movies(session, start_num) for start_num in start_nums]    
-        page_results = await asyncio.gather(*tasks)
-        
-        # 合并结果并截断到目标数量
-        for page_movies in page_results:
-            all_movies.extend(page_movies)
-            if len(all_movies) >= TARGET_MOVIE_COUNT:
-                all_movies = all_movies[:TARGET_MOVIE_COUNT]
-                break
+    # 信号量限制在途请求数，令牌桶限制每个域名的请求速率
+    semaphore = asyncio.Semaphore(MAX_IN_FLIGHT)
+    limiter = HostRateLimiter(RATE_PER_HOST, RATE_BURST)
+    parse_pool = ParsePool(PARSE_EXECUTOR, PARSE_WORKERS, MAX_PENDING_PARSES)
+    try:
+        async with make_session() as session:
+            # 生成对应页数的爬取任务
+            tasks = [fetch_movies(session, start_num, semaphore, limiter, parse_pool) for start_num in start_nums]
+            page_results = await asyncio.gather(*tasks)
+    finally:
+        parse_pool.close()
+    
+    # 合并结果并截断到目标数量
+    for page_movies in page_results:
+        all_movies.extend(page_movies)
+        if len(all_movies) >= TARGET_MOVIE_COUNT:
+            all_movies = all_movies[:TARGET_MOVIE_COUNT]
+            break
     
     # 打印结果
     print(f"\n=== 爬取结果（前{min(PRINT_COUNT, len(all_movies))}条）===")
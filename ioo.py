@@ -2,9 +2,12 @@ import re
 import threading
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from multiprocessing import Pool, cpu_count
-from typing import List, Dict, Any
-import requests
-from bs4 import BeautifulSoup
+from typing import List, Dict, Any, Optional
+
+from crawl_retry import RetryPolicy, HostCircuitBreakers, retry_sync
+from http_cache import HttpCache
+from http_session import PooledSessions
+from movie_parser import parse_items
 
 
 
@@ -13,8 +16,22 @@ TARGET_MOVIE_COUNT = 100    # 最终要爬取多少部电影
 PRINT_COUNT = 50            # 程序最后只打印前多少条结果
 PAGE_SIZE = 25              # 豆瓣 Top250 每页固定 25 部电影
 MAX_TOTAL_PAGE = 10         # Top250 一共 10 页
+BASE_URL = 'https://movie.douban.com/top250'
 THREAD_POOL_SIZE = 10       # 线程池里最多同时跑几个线程
 PROCESS_POOL_SIZE = cpu_count()  # 进程池大小
+REQUEST_TIMEOUT = 10        # 单个请求的超时秒数
+
+# 重试与熔断：503、429、连接错误、超时按指数退避重试；某个域名连续失败太多次时暂停请求它
+RETRY_POLICY = RetryPolicy(max_attempts=4, base_delay=0.5, max_delay=30)      # requests 的异常都是 OSError
+CIRCUIT_BREAKERS = HostCircuitBreakers(failure_threshold=5, recovery_timeout=30)
+
+# 网页缓存：再次运行时发条件请求，未变化的网页（304）直接用上次的解析结果；设为 None 关闭缓存
+HTTP_CACHE: Optional[HttpCache] = HttpCache('.http_cache', max_age=7 * 24 * 3600, max_bytes=200 * 1024 * 1024)
+PARSED_KEY = 'title_score_info'     # 解析结果在缓存中的键，ioo.py 和 iioo.py 的解析相同，共用
+
+# 网页解析后端：'auto'（有 selectolax / lxml 时用它们，都没有时用 BeautifulSoup）、'selectolax'、'lxml'、
+# 'bs4_strainer'（只解析 div.item）、'bs4'（原来的 html.parser 整页解析）
+PARSER_BACKEND = 'auto'
 
 
 
@@ -22,6 +39,10 @@ headers = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
 }
 
+# 连接池：每个线程一个 Session，共用按域名的连接池，后续请求复用已建立的连接，不再重复握手
+SESSIONS = PooledSessions(pool_connections=10, pool_maxsize=THREAD_POOL_SIZE, keep_alive=True, compress=True,
+                          headers=headers)
+
 
 
 results_lock = threading.Lock()
@@ -31,45 +52,71 @@ raw_movies: List[Dict[str, Any]] = []
 # 列表存放原始电影数据 每条是一个字典
 
 
+def _get_page(url: str, extra_headers: Optional[Dict[str, str]] = None):
+    # 一次请求尝试，返回 (状态码, 响应头, 网页文本)；extra_headers 为缓存的条件请求头
+    response = SESSIONS.get(url, headers=extra_headers, timeout=REQUEST_TIMEOUT)
+    return response.status_code, response.headers, response.text if response.status_code == 200 else None
+
+
+def parse_movies(html: str) -> List[Dict[str, Any]]:
+    """
+    从一页网页中解析出电影列表，每个元素是 {"title", "score", "info"} 的字典
+    """
+    movie_list = []
+
+    # 豆瓣每部电影在一个 class="item" 的 div 里，parse_items 取出每个 div 里的原始文本
+    for item in parse_items(html, PARSER_BACKEND):
+        
+        # 解析标题 strip用于去掉空格
+        title = item.title.strip() if item.title else "未知"
+
+        # 解析评分 
+        score = item.score.strip() if item.score else "0.0"
+
+        # 解析简介
+        info = item.info if item.info is not None else ""
+        movie_list.append({
+            "title": title.split('/')[0] if '/' in title else title,  # 把标题按 / 分割，取分割后的第一个部分
+            "score": score,
+            "info": info
+        })
+    return movie_list
+
+
 #多线程爬取
 def fetch_movies(start_num: int) -> List[Dict[str, Any]]:
     """
     返回：这一页解析出的电影列表，每个元素是 {"title", "score", "info"} 的字典。
     """
     # 豆瓣分页 URL：start=0 是第 1 页，start=25 是第 2 页，以此类推
-    url = f'https://movie.douban.com/top250?start={start_num}&filter='
+    url = f'{BASE_URL}?start={start_num}&filter='
     movie_list = []  # 本页的电影列表，先设为空
 
-    try:
-        # 发 GET 请求
-        response = requests.get(url, headers=headers, timeout=10)
+    # 有缓存时带上条件请求头，网页没变服务器会返回 304
+    entry = HTTP_CACHE.get(url) if HTTP_CACHE is not None else None
+    cache_headers = HttpCache.conditional_headers(entry)
 
-        if response.status_code != 200:
-            print(f"Page {start_num//PAGE_SIZE+1} 请求失败，状态码：{response.status_code}")
+    try:
+        # 发 GET 请求，失败时按指数退避重试（遵守 Retry-After），域名熔断时直接放弃
+        status, response_headers, html = retry_sync(lambda: _get_page(url, cache_headers), url,
+                                                    RETRY_POLICY, CIRCUIT_BREAKERS)
+
+        if status == 304 and entry is not None:
+            # 网页没变：直接用缓存的解析结果，没有时解析缓存的网页
+            movie_list = entry['parsed'].get(PARSED_KEY)
+            if movie_list is None:
+                movie_list = parse_movies(entry['body'])
+            HTTP_CACHE.revalidated(url, entry, response_headers, PARSED_KEY, movie_list)
+            print(f"Page {start_num//PAGE_SIZE+1} 未变化，使用缓存，本页 {len(movie_list)} 部电影")
+            return movie_list
+
+        if status != 200:
+            print(f"Page {start_num//PAGE_SIZE+1} 请求失败，状态码：{status}")
             return movie_list  # 直接返回空列表
-        
-        soup = BeautifulSoup(response.text, 'html.parser')
-
-        # 豆瓣每部电影在一个 class="item" 的 div 里，找出本页所有这样的 div
-        for item in soup.find_all('div', class_='item'):
-            
-            # 解析标题 strip用于去掉空格
-            title_tag = item.find('span', class_='title')
-            title = title_tag.string.strip() if title_tag and title_tag.string else "未知"
-
-            # 解析评分 
-            score_tag = item.find('span', class_='rating_num')
-            score = score_tag.string.strip() if score_tag and score_tag.string else "0.0"
-
-            # 解析简介
-            info_p = item.find('p', )
-            info = info_p.get_text(strip=True) if info_p else ""
-            #不要直接把tag的哪些beautifulsoup对象放进去了
-            movie_list.append({
-                "title": title.split('/')[0] if '/' in title else title,  # 把标题按 / 分割，取分割后的第一个部分
-                "score": score,
-                "info": info
-            })
+
+        movie_list = parse_movies(html)
+        if HTTP_CACHE is not None:
+            HTTP_CACHE.put(url, html, response_headers, PARSED_KEY, movie_list)
 
         print(f"Page {start_num//PAGE_SIZE+1} 爬取完成，本页 {len(movie_list)} 部电影")
 
@@ -150,6 +197,9 @@ def main():
                     raw_movies = raw_movies[:TARGET_MOVIE_COUNT]
                     break
 
+    stats = SESSIONS.stats()
+    print(f"\n连接复用：{stats['requests']} 次请求，新建 {stats['new_connections']} 个连接，复用率 {stats['reuse_rate']:.0%}")
+
    
     print(f"\n开始用 {PROCESS_POOL_SIZE} 个进程处理 {len(raw_movies)} 条电影数据...")
     with Pool(PROCESS_POOL_SIZE) as process_pool:
@@ -167,4 +217,6 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # 爬完后关闭各线程的 Session 和连接池
+    with SESSIONS:
+        main()
\ No newline at end of file
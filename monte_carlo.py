@@ -0,0 +1,101 @@
+"""
+蒙特卡洛回测
+一次生成成千上万条股价路径（二维数组），在所有路径上向量化地跑均线+止损策略，
+得到夏普比率、收益、最大回撤的分布
+随机数使用 np.random.Generator，由 SeedSequence.spawn 按路径块派生独立的随机流，
+块的划分与进程数无关，所以不论用几个进程结果都相同
+"""
+from concurrent.futures import ProcessPoolExecutor
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+from backtest_core import rolling_mean_np, crossover_signal_np, position_np, performance_np
+from risk_metrics import compute_risk_metrics
+from timeframe_pyramid import trading_dates
+
+
+def _generate_block(seed_seq: np.random.SeedSequence, day_count: int, path_count: int,
+                    init_price: float) -> np.ndarray:
+    """
+    用一个独立随机流生成一块 (交易日 × 路径) 的股价
+    """
+    rng = np.random.default_rng(seed_seq)
+    daily_change = rng.uniform(-0.02, 0.02, (day_count, path_count))
+    price_paths = np.empty((day_count, path_count))
+    price_paths[0] = init_price
+    price_paths[1:] = init_price * np.cumprod(1 + daily_change[1:], axis=0)
+    return price_paths
+
+
+def _block_sizes(path_count: int, block_size: int):
+    return [min(block_size, path_count - start) for start in range(0, path_count, block_size)]
+
+
+def generate_price_paths(path_count: int, day_count: int, init_price: float = 100.0,
+                         random_seed: int = 101, block_size: int = 256) -> np.ndarray:
+    """
+    生成 (交易日 × 路径) 的股价矩阵，与 run_monte_carlo 使用的路径完全一致
+    """
+    sizes = _block_sizes(path_count, block_size)
+    seed_seqs = np.random.SeedSequence(random_seed).spawn(len(sizes))
+    return np.hstack([_generate_block(ss, day_count, n, init_price) for ss, n in zip(seed_seqs, sizes)])
+
+
+def _run_block(task: Tuple) -> pd.DataFrame:
+    """
+    子进程：生成一块路径并回测，返回这一块每条路径的绩效
+    """
+    seed_seq, day_count, path_count, init_price, ma5_window, ma20_window, stop_loss_threshold, risk_free_rate = task
+    price_paths = _generate_block(seed_seq, day_count, path_count, init_price)
+
+    ma_diff = rolling_mean_np(price_paths, ma5_window) - rolling_mean_np(price_paths, ma20_window)
+    position = position_np(price_paths, crossover_signal_np(ma_diff), stop_loss_threshold)
+    metrics = performance_np(price_paths, position, risk_free_rate)
+
+    # 回撤、索提诺、卡玛等风险指标，所有路径一起算
+    strategy_return = (price_paths[1:] / price_paths[:-1] - 1) * position[1:]
+    risk = compute_risk_metrics(strategy_return, position[1:], risk_free_rate, day_count=day_count)
+    for name in ("max_drawdown", "max_drawdown_duration", "sortino_ratio", "calmar_ratio", "hit_rate", "turnover"):
+        metrics[name] = risk[name]
+    return pd.DataFrame(metrics)
+
+
+def run_monte_carlo(path_count=1000, start_date='2025-01-01', end_date='2025-12-31',
+                    init_price=100.0, stop_loss_threshold=-0.05, risk_free_rate=0.03,
+                    ma5_window=5, ma20_window=20, random_seed=101,
+                    block_size=256, max_workers=None) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    蒙特卡洛回测
+     path_count: 模拟的股价路径条数
+     block_size: 每个随机流（每个任务）包含的路径数，决定随机数的划分，改变它会改变结果
+     max_workers: 进程数，为 1 时在当前进程串行计算；不影响结果
+    其余参数与 MAStopLossBacktest 相同
+    返回 (每条路径的绩效表, 绩效分布统计)
+    """
+    day_count = len(trading_dates(start_date, end_date))
+    sizes = _block_sizes(path_count, block_size)
+    seed_seqs = np.random.SeedSequence(random_seed).spawn(len(sizes))
+    tasks = [(ss, day_count, n, init_price, ma5_window, ma20_window, stop_loss_threshold, risk_free_rate)
+             for ss, n in zip(seed_seqs, sizes)]
+
+    # executor.map 按提交顺序返回，拼接顺序固定
+    if max_workers == 1:
+        block_results = list(map(_run_block, tasks))
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            block_results = list(executor.map(_run_block, tasks))
+
+    path_df = pd.concat(block_results, ignore_index=True)
+    summary_df = path_df.describe(percentiles=[0.05, 0.25, 0.5, 0.75, 0.95])
+    return path_df, summary_df
+
+
+def main():
+    path_df, summary_df = run_monte_carlo(path_count=10000)
+    print(summary_df.to_string())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+"""
+豆瓣 Top250 网页解析
+三个爬虫原来都用 BeautifulSoup(html, 'html.parser') 建整棵树再 find_all('div', class_='item')，纯 Python 的解析器
+是每页 CPU 开销的大头。这里把“找出每部电影的名称、评分、简介”抽成可替换的后端：
+  selectolax    C 实现，最快（pip install selectolax）
+  lxml          C 实现（pip install lxml）
+  bs4_strainer  BeautifulSoup + SoupStrainer，只建 div.item 的子树；装了 lxml 时用 lxml 做底层解析
+  bs4           原来的做法：html.parser 建整棵树
+'auto' 按上面的顺序选第一个可用的，可选库都没装时退回 BeautifulSoup
+各后端只负责取出原始文本，标题过滤、默认值等规则仍由各爬虫自己处理
+
+微基准：python movie_parser.py [网页文件.html]，不给文件时用生成的示例网页
+"""
+import argparse
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+
+BACKENDS = ('selectolax', 'lxml', 'bs4_strainer', 'bs4')
+
+
+class MovieItem(NamedTuple):
+    """
+    一个 div.item 里取出的原始文本，对应的标签不存在时为 None
+     title: 第一个 span.title 的文本（未去空格）
+     score: span.rating_num 的文本（未去空格）
+     info: 第一个 p 的文本，与 get_text(strip=True) 相同：每段文本去掉首尾空白后直接拼接
+    """
+    title: Optional[str]
+    score: Optional[str]
+    info: Optional[str]
+
+
+def _strip_join(texts) -> str:
+    return ''.join(text.strip() for text in texts)
+
+
+# ---- selectolax ----
+def _items_selectolax(html: str) -> List[MovieItem]:
+    from selectolax.lexbor import LexborHTMLParser
+    items = []
+    for node in LexborHTMLParser(html).css('div.item'):
+        title = node.css_first('span.title')
+        score = node.css_first('span.rating_num')
+        info = node.css_first('p')
+        items.append(MovieItem(
+            title.text(deep=True) if title is not None else None,
+            score.text(deep=True) if score is not None else None,
+            info.text(deep=True, separator='', strip=True) if info is not None else None,
+        ))
+    return items
+
+
+# ---- lxml ----
+_lxml_xpath = {}
+
+
+def _has_class(name: str) -> str:
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+def _items_lxml(html: str) -> List[MovieItem]:
+    import lxml.html
+    from lxml import etree
+    if not _lxml_xpath:
+        # 预编译 XPath，各页共用
+        _lxml_xpath.update(
+            item=etree.XPath(f"//div[{_has_class('item')}]"),
+            title=etree.XPath(f".//span[{_has_class('title')}]"),
+            score=etree.XPath(f".//span[{_has_class('rating_num')}]"),
+            info=etree.XPath(".//p"),
+        )
+    xpath = _lxml_xpath
+    items = []
+    for node in xpath['item'](lxml.html.fromstring(html)):
+        title = xpath['title'](node)
+        score = xpath['score'](node)
+        info = xpath['info'](node)
+        items.append(MovieItem(
+            ''.join(title[0].itertext()) if title else None,
+            ''.join(score[0].itertext()) if score else None,
+            _strip_join(info[0].itertext()) if info else None,
+        ))
+    return items
+
+
+# ---- BeautifulSoup ----
+def _bs4_items(soup) -> List[MovieItem]:
+    items = []
+    for node in soup.find_all('div', class_='item'):
+        title = node.find('span', class_='title')
+        score = node.find('span', class_='rating_num')
+        info = node.find('p')
+        items.append(MovieItem(
+            title.get_text() if title is not None else None,
+            score.get_text() if score is not None else None,
+            info.get_text(strip=True) if info is not None else None,
+        ))
+    return items
+
+
+def _is_item_class(value) -> bool:
+    # 解析时 SoupStrainer 拿到的是原始的 class 字符串，class="item x" 这类要拆开判断
+    if not value:
+        return False
+    return 'item' in (value.split() if isinstance(value, str) else value)
+
+
+def _items_bs4_strainer(html: str) -> List[MovieItem]:
+    from bs4 import BeautifulSoup, SoupStrainer
+    # 只把 div.item 及其子孙放进树里，其余标签解析后直接丢弃
+    features = 'lxml' if _importable('lxml') else 'html.parser'
+    return _bs4_items(BeautifulSoup(html, features, parse_only=SoupStrainer('div', class_=_is_item_class)))
+
+
+def _items_bs4(html: str) -> List[MovieItem]:
+    from bs4 import BeautifulSoup
+    return _bs4_items(BeautifulSoup(html, 'html.parser'))
+
+
+_BACKEND_FUNCS: Dict[str, Callable[[str], List[MovieItem]]] = {
+    'selectolax': _items_selectolax,
+    'lxml': _items_lxml,
+    'bs4_strainer': _items_bs4_strainer,
+    'bs4': _items_bs4,
+}
+_BACKEND_MODULES = {'selectolax': 'selectolax', 'lxml': 'lxml', 'bs4_strainer': 'bs4', 'bs4': 'bs4'}
+_importable_cache = {}
+
+
+def _importable(module: str) -> bool:
+    if module not in _importable_cache:
+        try:
+            __import__(module)
+            _importable_cache[module] = True
+        except ImportError:
+            _importable_cache[module] = False
+    return _importable_cache[module]
+
+
+def available_backends() -> List[str]:
+    return [name for name in BACKENDS if _importable(_BACKEND_MODULES[name])]
+
+
+def resolve_backend(backend: str = 'auto') -> str:
+    """
+    'auto' 返回第一个可用的后端；指定的后端不存在时抛出 ValueError，依赖没装时抛出 ImportError
+    """
+    if backend == 'auto':
+        available = available_backends()
+        if not available:
+            raise ImportError("解析网页需要安装 beautifulsoup4：pip install beautifulsoup4")
+        return available[0]
+    if backend not in _BACKEND_FUNCS:
+        raise ValueError(f"未知的解析后端：{backend}，可选：{', '.join(('auto',) + BACKENDS)}")
+    if not _importable(_BACKEND_MODULES[backend]):
+        raise ImportError(f"解析后端 {backend} 需要安装 {_BACKEND_MODULES[backend]}：pip install {_BACKEND_MODULES[backend]}")
+    return backend
+
+
+def parse_items(html: str, backend: str = 'auto') -> List[MovieItem]:
+    """
+    取出网页中每个 div.item 的原始文本
+    """
+    return _BACKEND_FUNCS[resolve_backend(backend)](html)
+
+
+def sample_page(count: int = 25) -> str:
+    """
+    生成一页结构与豆瓣 Top250 相同的示例网页，用于基准测试
+    """
+    items = []
+    for i in range(count):
+        items.append(f'''<li><div class="item"><div class="pic"><em class="">{i + 1}</em>
+<a href="https://movie.douban.com/subject/{i}/"><img width="100" alt="电影{i}" src="https://img.example/{i}.jpg" class=""></a></div>
+<div class="info"><div class="hd"><a href="https://movie.douban.com/subject/{i}/" class="">
+<span class="title">电影{i}</span><span class="title">&nbsp;/&nbsp;The Movie {i}</span>
+<span class="other">&nbsp;/&nbsp;别名{i}</span></a><span class="playable">[可播放]</span></div>
+<div class="bd"><p class="">
+    导演: 导演{i}&nbsp;&nbsp;&nbsp;主演: 演员{i} / 演员{i + 1}...<br>
+    {1950 + i}&nbsp;/&nbsp;美国&nbsp;/&nbsp;剧情 犯罪
+</p><div><span class="rating5-t"></span><span class="rating_num" property="v:average">{9.7 - i * 0.02:.1f}</span>
+<span property="v:best" content="10.0"></span><span>{3000000 - i * 1000}人评价</span></div>
+<p class="quote"><span>引言{i}</span></p></div></div></div></li>''')
+    nav = ''.join(f'<li><a href="https://movie.douban.com/chart{i}">导航{i}</a></li>' for i in range(200))
+    return ('<!DOCTYPE html><html lang="zh-CN"><head><meta charset="utf-8"><title>豆瓣电影 Top 250</title>'
+            '<script>var x = 1;</script></head><body><div id="db-global-nav"><ul>' + nav + '</ul></div>'
+            '<div id="content"><ol class="grid_view">' + ''.join(items) + '</ol></div></body></html>')
+
+
+def benchmark(html: str, backends: Optional[List[str]] = None, repeat: int = 20) -> Dict[str, float]:
+    """
+    每个后端解析 repeat 次，返回每页耗时（毫秒，取最快一次）
+    """
+    result = {}
+    for backend in backends or available_backends():
+        func = _BACKEND_FUNCS[resolve_backend(backend)]
+        func(html)          # 预热：导入模块、编译 XPath
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func(html)
+            best = min(best, time.perf_counter() - start)
+        result[backend] = best * 1000
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="各解析后端的每页解析耗时")
+    parser.add_argument("html_file", nargs='?', help="网页文件，不给时用生成的示例网页")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.html_file:
+        with open(args.html_file, encoding='utf-8') as f:
+            html = f.read()
+    else:
+        html = sample_page()
+
+    reference = parse_items(html, 'bs4')
+    timings = benchmark(html, repeat=args.repeat)
+    print(f"网页 {len(html) / 1024:.1f} KB，{len(reference)} 部电影")
+    for backend, ms in timings.items():
+        same = "一致" if parse_items(html, backend) == reference else "与 bs4 不一致"
+        print(f"{backend:<13} {ms:8.2f} ms/页  {timings['bs4'] / ms:5.1f}x  {same}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+MAStopLossBacktest 参数扫描
+股价只生成一次，按 (短均线, 长均线) 组合拆分任务分给进程池，
+同一组均线下的多个止损阈值共用均线和交易信号，只重算止损持仓和绩效
+"""
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, List, Dict, Any, Tuple
+
+import numpy as np
+import pandas as pd
+
+from backtest_core import generate_price_np, crossover_signal_np, position_np, performance_np
+from indicator_cache import IndicatorCache
+from timeframe_pyramid import trading_dates
+
+
+# 子进程里共享的股价数组和指标缓存，由 _init_worker 在进程启动时设置一次
+_worker_price = None
+_worker_cache = None
+
+
+def _init_worker(price: np.ndarray) -> None:
+    global _worker_price, _worker_cache
+    _worker_price = price
+    _worker_cache = IndicatorCache()
+
+
+def _run_ma_pair(task: Tuple[int, int, List[float], float]) -> List[Dict[str, Any]]:
+    """
+    计算一组均线窗口下所有止损阈值的回测结果
+    """
+    ma5_window, ma20_window, stop_loss_list, risk_free_rate = task
+    price = _worker_price
+    # 累加和每个进程只算一次，各窗口的均线直接由它得到
+    ma_diff = _worker_cache.sma(price, ma5_window) - _worker_cache.sma(price, ma20_window)
+    signal = crossover_signal_np(ma_diff)
+
+    rows = []
+    for stop_loss_threshold in stop_loss_list:
+        position = position_np(price, signal, stop_loss_threshold)
+        row = {
+            "ma5_window": ma5_window,
+            "ma20_window": ma20_window,
+            "stop_loss_threshold": stop_loss_threshold,
+        }
+        row.update(performance_np(price, position, risk_free_rate))
+        rows.append(row)
+    return rows
+
+
+def run_param_sweep(ma5_range: Iterable[int], ma20_range: Iterable[int],
+                    stop_loss_range: Iterable[float],
+                    start_date='2025-01-01', end_date='2025-12-31',
+                    init_price=100.0, risk_free_rate=0.03, random_seed=101,
+                    max_workers=None, chunksize=8) -> pd.DataFrame:
+    """
+    参数网格扫描
+     ma5_range / ma20_range: 短、长均线窗口的取值范围
+     stop_loss_range: 止损阈值的取值范围
+     start_date / end_date / init_price / random_seed: 与 MAStopLossBacktest 相同，用于生成同一条股价
+     max_workers: 进程数，默认 CPU 核数；为 1 时在当前进程串行计算
+     chunksize: 每次发给子进程的任务数
+    返回每个参数组合一行的结果表（夏普比率、年化收益、年化波动率等）
+    """
+    day_count = len(trading_dates(start_date, end_date))
+    price = generate_price_np(day_count, init_price, random_seed)
+
+    stop_loss_list = [float(x) for x in stop_loss_range]
+    tasks = [(int(ma5), int(ma20), stop_loss_list, risk_free_rate)
+             for ma5, ma20 in itertools.product(ma5_range, ma20_range)]
+
+    if max_workers == 1:
+        _init_worker(price)
+        results = map(_run_ma_pair, tasks)
+        rows = [row for rows in results for row in rows]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                                 initargs=(price,)) as executor:
+            results = executor.map(_run_ma_pair, tasks, chunksize=chunksize)
+            rows = [row for rows in results for row in rows]
+
+    return pd.DataFrame(rows)
+
+
+def main():
+    result_df = run_param_sweep(range(3, 11), range(15, 61, 5), [-0.03, -0.05, -0.08, -0.1])
+    print(result_df.sort_values("sharpe_ratio", ascending=False).head(10).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
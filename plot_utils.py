@@ -0,0 +1,56 @@
+"""
+绘图工具
+matplotlib 只在真正要画图时才导入；长序列先用 LTTB 算法降采样再画，
+无界面服务器上可以直接渲染到文件
+"""
+import numpy as np
+
+
+def get_pyplot(headless: bool = False):
+    """
+    延迟导入 matplotlib.pyplot，并设置中文字体
+     headless: True 时使用 Agg 后端，只渲染到文件，不弹窗口
+    """
+    import matplotlib
+    if headless:
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    # 保证中文显示
+    plt.rcParams['font.sans-serif'] = ['SimHei']
+    plt.rcParams['axes.unicode_minus'] = False
+    return plt
+
+
+def lttb_indices(y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets 降采样，返回保留点的下标
+    横坐标按等间距处理（交易日序号）；首尾两点总是保留，NaN 按 0 面积处理
+    """
+    y = np.asarray(y, dtype=np.float64)
+    n = y.shape[0]
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    y_filled = np.where(np.isnan(y), 0.0, y)
+    x = np.arange(n, dtype=np.float64)
+    # 去掉首尾，中间的点均分到 n_out-2 个桶里
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+
+    indices = np.empty(n_out, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = n - 1
+    prev = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        # 下一个桶的平均点作为三角形的第三个顶点
+        next_start, next_end = end, edges[i + 2] if i + 2 < n_out - 1 else n
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y_filled[next_start:next_end].mean()
+
+        # 当前桶里与前一个选中点、下一桶平均点构成面积最大的三角形的点
+        area = np.abs((x[prev] - avg_x) * (y_filled[start:end] - y_filled[prev])
+                      - (x[prev] - x[start:end]) * (avg_y - y_filled[prev]))
+        prev = start + int(np.argmax(area))
+        indices[i + 1] = prev
+    return indices
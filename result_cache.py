@@ -0,0 +1,186 @@
+"""
+回测结果的磁盘缓存（按内容寻址）
+键 = sha256(构造参数 + 数据来源指纹 + 代码版本)，参数、数据或计算代码任何一个变了都会自然失效
+每条结果是一个 .npz 文件：绩效指标（JSON）+ 可选的交易信号 / 持仓数组，总大小超过上限时删除最久未用的
+多个进程可以共用一个缓存目录（服务的工作进程、参数扫描），别的进程随时可能删掉某个文件，读写和淘汰都要容忍文件已不存在
+"""
+import hashlib
+import json
+import os
+import tempfile
+from typing import Dict, Any, Optional, Tuple
+
+import numpy as np
+
+
+# 参与计算结果的源文件，内容变化即视为代码版本变化
+CODE_FILES = ('backtest_core.py', 'try_change.py', 'risk_metrics.py', 'timeframe_pyramid.py')
+_code_version = None
+
+
+def code_version() -> str:
+    """
+    计算结果相关源码的哈希（每个进程只算一次）
+    """
+    global _code_version
+    if _code_version is None:
+        digest = hashlib.sha256()
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+        for name in CODE_FILES:
+            with open(os.path.join(base_dir, name), 'rb') as f:
+                digest.update(f.read())
+        _code_version = digest.hexdigest()[:16]
+    return _code_version
+
+
+def fingerprint_array(arr: np.ndarray) -> str:
+    """
+    数组内容的指纹（用于外部传入的股价数据）
+    """
+    arr = np.ascontiguousarray(arr)
+    digest = hashlib.sha256(str((arr.dtype.str, arr.shape)).encode())
+    digest.update(arr.data)
+    return digest.hexdigest()
+
+
+def fingerprint_file(path: str) -> str:
+    """
+    数据文件的指纹：路径 + 大小 + 修改时间，不读取文件内容
+    """
+    stat = os.stat(path)
+    return f"file:{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+class ResultCache:
+    """
+    按内容寻址的回测结果缓存
+    """
+    def __init__(self, cache_dir: str = '.backtest_cache', max_bytes: int = 512 * 1024 * 1024,
+                 store_arrays: bool = False, evict_every: int = 100):
+        """
+         cache_dir: 缓存目录
+         max_bytes: 缓存总大小上限，超过时按最近使用时间淘汰
+         store_arrays: 是否同时保存股价、交易信号和持仓数组（画图时不用重算）
+         evict_every: 每写入多少次重新遍历目录统计总大小（其他进程写入的大小只有遍历时才能算上）
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.store_arrays = store_arrays
+        self.evict_every = evict_every
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._bytes = None          # 上次遍历得到的总大小 + 之后本进程写入的大小，None 表示还没遍历过
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(params: Dict[str, Any], data_fingerprint: str, version: Optional[str] = None) -> str:
+        payload = json.dumps({"params": params, "data": data_fingerprint, "code": version or code_version()},
+                             sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key + '.npz')
+
+    def get(self, key: str) -> Optional[Tuple[Dict[str, Any], Dict[str, np.ndarray]]]:
+        """
+        命中时返回 (绩效字典, 数组字典)，没有保存数组时数组字典为空；未命中返回 None
+        """
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                metrics = json.loads(bytes(data['__metrics__']).decode('utf-8'))
+                arrays = {name: data[name] for name in data.files if name != '__metrics__'}
+        except (OSError, ValueError, KeyError):
+            self.misses += 1
+            return None
+        try:
+            os.utime(path)                          # 更新修改时间，作为最近使用时间
+        except FileNotFoundError:                   # 读完后被其他进程淘汰了，结果照样可用
+            pass
+        self.hits += 1
+        return metrics, _decode_arrays(arrays)
+
+    def put(self, key: str, metrics: Dict[str, Any], arrays: Optional[Dict[str, np.ndarray]] = None) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        payload = {'__metrics__': np.frombuffer(json.dumps(metrics).encode('utf-8'), dtype=np.uint8)}
+        if self.store_arrays and arrays:
+            payload.update(_encode_arrays(arrays))
+
+        # 先写临时文件再改名，多个进程同时写同一个键也不会读到半个文件
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez_compressed(f, **payload)
+                size = f.tell()
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        # 遍历目录是 O(条目数)，不能每次写入都做：累计大小超过上限，或每写入 evict_every 次时才遍历
+        self._puts += 1
+        if self._bytes is not None:
+            self._bytes += size
+        if self._bytes is None or self._bytes > self.max_bytes or self._puts % self.evict_every == 0:
+            self._evict()
+
+    def _evict(self) -> None:
+        """
+        统计总大小，超过上限时按最近使用时间删到上限的 90%，留出余量，避免缓存满了以后每次写入都要遍历
+        """
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith('.npz'):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:       # 遍历时被其他进程删了
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        if total > self.max_bytes:
+            target = self.max_bytes * 0.9
+            for _, size, path in sorted(entries):
+                if total <= target:
+                    break
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+        self._bytes = total
+
+    def clear(self) -> None:
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith('.npz'):
+                    try:
+                        os.unlink(os.path.join(root, name))
+                    except FileNotFoundError:
+                        pass
+        self._bytes = 0
+
+
+def _encode_arrays(arrays: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    # 交易信号（1/0/NaN）存成 int8，NaN 记为 -1；持仓（0/1）存成 int8
+    encoded = {'price': np.asarray(arrays['price'], dtype=np.float64)}
+    if 'trade_signal' in arrays:
+        trade_signal = arrays['trade_signal']
+        encoded['trade_signal'] = np.where(np.isnan(trade_signal), -1, trade_signal).astype(np.int8)
+    if 'position' in arrays:
+        encoded['position'] = np.asarray(arrays['position']).astype(np.int8)
+    return encoded
+
+
+def _decode_arrays(arrays: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    decoded = dict(arrays)
+    if 'trade_signal' in arrays:
+        trade_signal = arrays['trade_signal'].astype(np.float64)
+        trade_signal[arrays['trade_signal'] == -1] = np.nan
+        decoded['trade_signal'] = trade_signal
+    if 'position' in arrays:
+        decoded['position'] = arrays['position'].astype(np.float64)
+    return decoded
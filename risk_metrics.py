@@ -0,0 +1,241 @@
+"""
+风险指标库
+由策略日收益算出总收益、年化收益、波动率、夏普、索提诺、卡玛、最大回撤及其持续时间、
+胜率、换手率和滚动夏普
+安装了 numba 时用编译后的内核对每条收益序列只遍历一次，净值、回撤、方差、滚动窗口等都在同一次遍历里累计；
+没有 numba 时退回逐个指标的向量化 NumPy 实现（净值曲线只算一次，收益、回撤相关指标都由它得到）
+支持一维（单次回测）和二维（交易日 × 多次回测 / 多只股票）输入，沿第 0 轴计算
+"""
+from typing import Dict, Any, Optional
+
+import numpy as np
+
+from backtest_core import TRADING_DAYS_PER_YEAR, HAS_NUMBA
+
+if HAS_NUMBA:
+    from numba import njit
+
+
+def _safe_ratio(numerator, denominator):
+    # 分母为 0 或 NaN 时记为 0，与夏普比率的处理一致
+    valid = (denominator != 0) & ~np.isnan(denominator)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(valid, numerator / denominator, 0.0)
+
+
+def _risk_stats_np(r: np.ndarray, position: Optional[np.ndarray], rolling_window: int, risk_free_rate: float,
+                   periods_per_year: float) -> Dict[str, Any]:
+    """
+    向量化 NumPy 版：逐个指标整列计算
+    """
+    n = r.shape[0]
+
+    # 净值曲线：总收益、回撤都由它得到
+    equity = np.cumprod(1 + r, axis=0)
+    growth = equity[-1] if n else np.ones(r.shape[1:])
+
+    # 整体波动率用两遍法（数值更稳定，与 calculate_performance 一致）
+    daily_volatility = r.std(axis=0, ddof=1) if n > 1 else np.full(r.shape[1:], np.nan)
+
+    # 下行波动率只统计亏损的日子
+    downside = np.minimum(r, 0)
+    downside_mean_sq = (downside * downside).mean(axis=0) if n else np.full(r.shape[1:], np.nan)
+
+    # 最大回撤：净值相对历史最高点（含初始净值 1）的最大跌幅；持续时间为最长的水下K线数
+    peak = np.maximum(np.maximum.accumulate(equity, axis=0), 1.0)
+    drawdown = equity / peak - 1
+    max_drawdown = drawdown.min(axis=0) if n else np.zeros(r.shape[1:])
+    row_idx = np.arange(1, n + 1).reshape((-1,) + (1,) * (r.ndim - 1))
+    last_peak = np.maximum.accumulate(np.where(drawdown >= 0, row_idx, 0), axis=0)
+    max_drawdown_duration = (row_idx - last_peak).max(axis=0) if n else np.zeros(r.shape[1:], dtype=np.int64)
+
+    # 滚动夏普：窗口内均值和标准差由收益及其平方的累加和差分得到，O(n)
+    rolling_sharpe = np.full(r.shape, np.nan)
+    w = rolling_window
+    if 1 < w <= n:
+        csum = np.zeros((n + 1,) + r.shape[1:])
+        csum_sq = np.zeros((n + 1,) + r.shape[1:])
+        np.cumsum(r, axis=0, out=csum[1:])
+        np.cumsum(r * r, axis=0, out=csum_sq[1:])
+        window_sum = csum[w:] - csum[:-w]
+        window_sq = csum_sq[w:] - csum_sq[:-w]
+        window_mean = window_sum / w
+        window_std = np.sqrt(np.maximum(window_sq - w * window_mean * window_mean, 0) / (w - 1))
+        rolling_sharpe[w - 1:] = _safe_ratio(window_mean * periods_per_year - risk_free_rate,
+                                             window_std * np.sqrt(periods_per_year))
+
+    return {
+        "growth": growth,
+        "daily_volatility": daily_volatility,
+        "downside_mean_sq": downside_mean_sq,
+        "max_drawdown": max_drawdown,
+        "max_drawdown_duration": max_drawdown_duration,
+        # 胜率：有收益变动的K线里赚钱的比例
+        "wins": (r > 0).sum(axis=0),
+        "active": (r != 0).sum(axis=0),
+        # 持仓变动的总量（从空仓开始算）
+        "changes": None if position is None else np.abs(np.diff(position, axis=0, prepend=0)).sum(axis=0),
+        "rolling_sharpe": rolling_sharpe,
+    }
+
+
+if HAS_NUMBA:
+    @njit(cache=True)
+    def _risk_kernel_numba(r, position, has_position, w, risk_free_rate, periods_per_year, rolling_sharpe,
+                           stats, durations):
+        # r / position / rolling_sharpe 每行是一条收益序列；每条序列只遍历一次，
+        # 同时累计净值、回撤、方差（Welford）、下行平方和、胜负次数、持仓变动和滚动窗口的和与平方和
+        sqrt_ppy = np.sqrt(periods_per_year)
+        for j in range(r.shape[0]):
+            n = r.shape[1]
+            equity = 1.0
+            peak = 1.0
+            max_drawdown = 0.0
+            last_peak = 0
+            max_duration = 0
+            mean = 0.0
+            m2 = 0.0
+            downside_sq = 0.0
+            wins = 0
+            active = 0
+            changes = 0.0
+            previous = 0.0
+            window_sum = 0.0
+            window_sq = 0.0
+            window_active = 0
+            for t in range(n):
+                x = r[j, t]
+                equity *= 1 + x
+                if equity > peak:
+                    peak = equity
+                drawdown = equity / peak - 1
+                if drawdown < max_drawdown:
+                    max_drawdown = drawdown
+                if drawdown >= 0:
+                    last_peak = t + 1
+                elif t + 1 - last_peak > max_duration:
+                    max_duration = t + 1 - last_peak
+
+                delta = x - mean
+                mean += delta / (t + 1)
+                m2 += delta * (x - mean)
+                if x < 0:
+                    downside_sq += x * x
+                if x > 0:
+                    wins += 1
+                if x != 0:
+                    active += 1
+                if has_position:
+                    changes += abs(position[j, t] - previous)
+                    previous = position[j, t]
+
+                if w > 1:
+                    window_sum += x
+                    window_sq += x * x
+                    window_active += x != 0
+                    if t >= w:
+                        old = r[j, t - w]
+                        window_sum -= old
+                        window_sq -= old * old
+                        window_active -= old != 0
+                    if window_active == 0:
+                        # 空仓的窗口收益全为 0，清掉加减留下的舍入残差，否则标准差不为 0，夏普会变成极大的数
+                        window_sum = 0.0
+                        window_sq = 0.0
+                    if t >= w - 1:
+                        window_mean = window_sum / w
+                        variance = (window_sq - w * window_mean * window_mean) / (w - 1)
+                        denominator = np.sqrt(max(variance, 0.0)) * sqrt_ppy
+                        if denominator != 0 and not np.isnan(denominator):
+                            rolling_sharpe[j, t] = (window_mean * periods_per_year - risk_free_rate) / denominator
+                        else:
+                            rolling_sharpe[j, t] = 0.0
+
+            stats[0, j] = equity
+            stats[1, j] = np.sqrt(m2 / (n - 1)) if n > 1 else np.nan
+            stats[2, j] = downside_sq / n if n else np.nan
+            stats[3, j] = max_drawdown
+            stats[4, j] = wins
+            stats[5, j] = active
+            stats[6, j] = changes
+            durations[j] = max_duration
+
+
+def _risk_stats_fused(r: np.ndarray, position: Optional[np.ndarray], rolling_window: int, risk_free_rate: float,
+                      periods_per_year: float) -> Dict[str, Any]:
+    """
+    numba 版：每条收益序列一次遍历算出全部统计量
+    """
+    n = r.shape[0]
+    # 转成每行一条序列的连续数组，与 _run_position_kernel 的二维处理相同
+    m = int(np.prod(r.shape[1:]))
+    r_t = np.ascontiguousarray(r.reshape(n, m).T)
+    position_t = np.ascontiguousarray(position.reshape(n, m).T) if position is not None else np.zeros((m, 0))
+    rolling_t = np.full((m, n), np.nan)
+    stats = np.empty((7, m))
+    durations = np.empty(m, dtype=np.int64)
+    w = rolling_window if 1 < rolling_window <= n else 0
+    _risk_kernel_numba(r_t, position_t, position is not None, w, float(risk_free_rate), float(periods_per_year),
+                       rolling_t, stats, durations)
+
+    shape = r.shape[1:]
+    return {
+        "growth": stats[0].reshape(shape),
+        "daily_volatility": stats[1].reshape(shape),
+        "downside_mean_sq": stats[2].reshape(shape),
+        "max_drawdown": stats[3].reshape(shape),
+        "max_drawdown_duration": durations.reshape(shape),
+        "wins": stats[4].reshape(shape),
+        "active": stats[5].reshape(shape),
+        "changes": stats[6].reshape(shape) if position is not None else None,
+        "rolling_sharpe": rolling_t.T.reshape(r.shape),
+    }
+
+
+def compute_risk_metrics(strategy_return: np.ndarray, position: Optional[np.ndarray] = None,
+                         risk_free_rate: float = 0.03, periods_per_year: int = TRADING_DAYS_PER_YEAR,
+                         rolling_window: int = 63, day_count: Optional[int] = None) -> Dict[str, Any]:
+    """
+     strategy_return: 策略日收益（不含第一天的 NaN），一维或二维
+     position: 可选，与 strategy_return 对齐的持仓，用于计算换手率
+     periods_per_year: 每年K线数，日线为 252
+     rolling_window: 滚动夏普的窗口
+     day_count: 年化用的交易日数，默认为收益条数 + 1（与 calculate_performance 口径一致）
+    返回指标字典；一维输入时标量指标为标量，rolling_sharpe 为与输入同形状的数组
+    """
+    r = np.asarray(strategy_return, dtype=np.float64)
+    n = r.shape[0]
+    day_count = day_count or n + 1
+    if position is not None:
+        position = np.asarray(position, dtype=np.float64)
+
+    risk_stats = _risk_stats_fused if HAS_NUMBA else _risk_stats_np
+    stats = risk_stats(r, position, rolling_window, risk_free_rate, periods_per_year)
+
+    growth = stats["growth"]
+    annual_return = growth ** (periods_per_year / day_count) - 1
+    annual_volatility = stats["daily_volatility"] * np.sqrt(periods_per_year)
+    downside_volatility = np.sqrt(stats["downside_mean_sq"]) * np.sqrt(periods_per_year)
+    max_drawdown = stats["max_drawdown"]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        hit_rate = stats["wins"] / stats["active"]
+
+    metrics = {
+        "total_strategy_return": growth - 1,
+        "annual_strategy_return": annual_return,
+        "annual_volatility": annual_volatility,
+        "sharpe_ratio": _safe_ratio(annual_return - risk_free_rate, annual_volatility),
+        "sortino_ratio": _safe_ratio(annual_return - risk_free_rate, downside_volatility),
+        "max_drawdown": max_drawdown,
+        "max_drawdown_duration": stats["max_drawdown_duration"],
+        "calmar_ratio": _safe_ratio(annual_return, np.abs(max_drawdown)),
+        "hit_rate": hit_rate,
+    }
+    if position is not None:
+        # 年化换手率：每年持仓变动的总量
+        metrics["turnover"] = stats["changes"] * periods_per_year / max(n, 1)
+
+    # 一维输入时把 0 维数组取成标量
+    metrics = {name: np.asarray(value)[()] for name, value in metrics.items()}
+    metrics["rolling_sharpe"] = stats["rolling_sharpe"]
+    return metrics
@@ -0,0 +1,177 @@
+"""
+均线金叉死叉+止损策略的增量（流式）回测
+每来一根K线调用一次 update(timestamp, price)，均线、金叉死叉、持仓和夏普比率都是 O(1) 更新，
+不需要重算整段历史，可直接用于实盘模拟
+"""
+import math
+from collections import deque
+from typing import Dict, Any
+
+from backtest_core import TRADING_DAYS_PER_YEAR
+
+
+class RunningMean:
+    """
+    固定窗口的滚动均值，维护窗口内的累加和
+    """
+    RESYNC_EVERY = 10000        # 每更新这么多次重新求一次和，避免浮点误差累积
+
+    def __init__(self, window: int):
+        self.window = window
+        self.values = deque()
+        self.total = 0.0
+        self.update_count = 0
+
+    def update(self, value: float) -> float:
+        self.values.append(value)
+        self.total += value
+        if len(self.values) > self.window:
+            self.total -= self.values.popleft()
+
+        self.update_count += 1
+        if self.update_count % self.RESYNC_EVERY == 0:
+            self.total = math.fsum(self.values)
+
+        # 数据不足一个窗口时和 rolling().mean() 一样返回 NaN
+        if len(self.values) < self.window:
+            return math.nan
+        return self.total / self.window
+
+
+class MAStopLossStream:
+    """
+    增量版的 MAStopLossBacktest
+    策略逻辑与 backtest_core.position_kernel 相同，绩效口径与 calculate_performance 相同
+    """
+    def __init__(self, stop_loss_threshold=-0.05, risk_free_rate=0.03,
+                 ma5_window=5, ma20_window=20, periods_per_year=TRADING_DAYS_PER_YEAR):
+        """
+        初始化增量回测参数
+         stop_loss_threshold: 止损阈值 默认-5%
+         risk_free_rate: 无风险收益率 默认3%
+         ma5_window: 5日均线窗口
+         ma20_window: 20日均线窗口
+         periods_per_year: 每年K线数，日线为 252，分钟线等由K线周期换算
+        """
+        self.stop_loss_threshold = stop_loss_threshold
+        self.risk_free_rate = risk_free_rate
+        self.ma5_window = ma5_window
+        self.ma20_window = ma20_window
+        self.periods_per_year = periods_per_year
+
+        # 指标状态
+        self.ma5 = RunningMean(ma5_window)
+        self.ma20 = RunningMean(ma20_window)
+        self.prev_diff = math.nan                   # 上一根K线的均线差值
+        self.prev_price = None                      # 上一根K线的收盘价
+
+        # 持仓状态
+        self.holding = False
+        self.entry_price = math.nan                 # 当前持仓的买入价格
+
+        # 绩效累计量：累乘收益 + Welford 在线方差
+        self.day_count = 0
+        self.strategy_growth = 1.0                  # (1+策略日收益) 累乘
+        self.benchmark_growth = 1.0                 # (1+股票日收益率) 累乘
+        self.return_count = 0
+        self.return_mean = 0.0
+        self.return_m2 = 0.0
+
+        # 与 MAStopLossBacktest 相同的结果属性
+        self.total_benchmark_return = 0.0
+        self.total_strategy_return = 0.0
+        self.annual_strategy_return = None
+        self.annual_volatility = None
+        self.sharpe_ratio = None
+
+    def update(self, timestamp, price: float) -> Dict[str, Any]:
+        """
+        输入一根新的K线，返回这根K线的均线、交易信号和持仓状态
+        交易信号：1 买入、0 卖出（含止损）、NaN 无操作
+        """
+        price = float(price)
+        ma5 = self.ma5.update(price)
+        ma20 = self.ma20.update(price)
+        diff = ma5 - ma20
+
+        # 金叉死叉，NaN 比较结果为 False
+        buy = self.prev_diff < 0 and diff >= 0
+        sell = self.prev_diff > 0 and diff <= 0
+        self.prev_diff = diff
+
+        # 持仓状态机：持仓时先看死叉再看止损，空仓时看金叉
+        trade_signal = math.nan
+        if self.holding:
+            if sell or (price - self.entry_price) / self.entry_price <= self.stop_loss_threshold:
+                self.holding = False
+                trade_signal = 0
+        elif buy:
+            self.holding = True
+            self.entry_price = price
+            trade_signal = 1
+        position = 1.0 if self.holding else 0.0
+
+        # 当日收益按当日持仓计算，与 calculate_performance 口径一致
+        self.day_count += 1
+        if self.prev_price is not None:
+            daily_return = price / self.prev_price - 1
+            self._update_performance(daily_return, daily_return * position)
+        self.prev_price = price
+
+        return {
+            "timestamp": timestamp,
+            "price": price,
+            "ma5": ma5,
+            "ma20": ma20,
+            "trade_signal": trade_signal,
+            "entry_price": self.entry_price if (self.holding or trade_signal == 0) else math.nan,
+            "position": position,
+        }
+
+    def _update_performance(self, daily_return: float, strategy_return: float) -> None:
+        self.benchmark_growth *= 1 + daily_return
+        self.strategy_growth *= 1 + strategy_return
+
+        # Welford 在线更新均值和平方差之和
+        self.return_count += 1
+        delta = strategy_return - self.return_mean
+        self.return_mean += delta / self.return_count
+        self.return_m2 += delta * (strategy_return - self.return_mean)
+
+        self.total_benchmark_return = self.benchmark_growth - 1
+        self.total_strategy_return = self.strategy_growth - 1
+        self.annual_strategy_return = self.strategy_growth ** (self.periods_per_year / self.day_count) - 1
+        if self.return_count > 1:
+            daily_volatility = math.sqrt(self.return_m2 / (self.return_count - 1))
+            self.annual_volatility = daily_volatility * math.sqrt(self.periods_per_year)
+        else:
+            self.annual_volatility = math.nan
+
+        if self.annual_volatility != 0 and not math.isnan(self.annual_volatility):
+            self.sharpe_ratio = (self.annual_strategy_return - self.risk_free_rate) / self.annual_volatility
+        else:
+            self.sharpe_ratio = 0
+
+
+def main():
+    import pandas as pd
+    from backtest_core import generate_price_np
+
+    date_list = pd.date_range(start='2025-01-01', end='2025-12-31', freq='B')
+    price_np = generate_price_np(len(date_list))
+
+    stream = MAStopLossStream()
+    for timestamp, price in zip(date_list, price_np):
+        bar = stream.update(timestamp, price)
+        if bar["trade_signal"] == 1:
+            print(f"{timestamp.date()} 买入 {price:.2f}")
+        elif bar["trade_signal"] == 0:
+            print(f"{timestamp.date()} 卖出 {price:.2f}")
+
+    print(f"\n策略最终收益：{stream.total_strategy_return:.2%}")
+    print(f"策略年化波动率：{stream.annual_volatility:.2%}")
+    print(f"策略夏普比率：{stream.sharpe_ratio:.2f}")
+
+
+if __name__ == "__main__":
+    main()
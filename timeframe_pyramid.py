@@ -0,0 +1,276 @@
+"""
+多周期K线金字塔
+由分钟线逐级重采样出 1分钟 -> 5分钟 -> 15分钟 -> 1小时 -> 日线，每一级只由上一级聚合一次，
+结果缓存在内存里（可选落盘），之后在任意周期上跑策略都不需要再从原始分钟线重采样
+日内K线只落在A股交易时段内，每个时段从开盘起切分，年化系数为 每日交易时段内的K线根数 × 252
+"""
+import hashlib
+import os
+from functools import lru_cache
+from typing import Dict, Any, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+from backtest_core import TRADING_DAYS_PER_YEAR, backtest_np
+
+
+TRADING_SESSIONS = (('09:30', '11:30'), ('13:00', '15:00'))   # A股每日交易时段，共 240 分钟
+PYRAMID_LEVELS = ('1min', '5min', '15min', '1h', '1D')
+
+# 上一级K线聚合成下一级时各列的取法，逐级聚合与直接由分钟线聚合结果相同
+OHLC_AGG = {'open': 'first', 'high': 'max', 'low': 'min', 'close': 'last', 'volume': 'sum'}
+
+
+def is_intraday(freq: str) -> bool:
+    offset = pd.tseries.frequencies.to_offset(freq)
+    return isinstance(offset, pd.offsets.Tick) and pd.Timedelta(offset) < pd.Timedelta('1D')
+
+
+def session_offsets(freq: str, sessions=TRADING_SESSIONS) -> np.ndarray:
+    """
+    日内周期每根K线相对当天零点的偏移（纳秒），每个交易时段从开盘起按周期切分，K线以起始时刻标记
+    如 '1h' 为 9:30、10:30、13:00、14:00 四根
+    """
+    step = pd.Timedelta(freq).value
+    return np.concatenate([np.arange(pd.Timedelta(f"{start}:00").value, pd.Timedelta(f"{end}:00").value, step)
+                           for start, end in sessions])
+
+
+def trading_dates(start_date, end_date, freq: str = 'B', sessions=TRADING_SESSIONS) -> pd.DatetimeIndex:
+    """
+    生成交易时间序列
+    freq='B' 时先生成自然日再去掉周末，结果与 pd.date_range(freq='B') 相同，但快两个数量级
+    日内周期只生成工作日交易时段内的K线（不含夜间、午休和周末）；end_date 只给日期时包含当天全部交易时段
+    """
+    if freq == 'B':
+        days = pd.date_range(start=start_date, end=end_date, freq='D')
+        return days[days.weekday < 5]
+    if not is_intraday(freq):
+        return pd.date_range(start=start_date, end=end_date, freq=freq)
+
+    start, end = pd.Timestamp(start_date), pd.Timestamp(end_date)
+    if end == end.normalize():
+        end = end + pd.Timedelta('1D') - pd.Timedelta(1)
+    days = trading_dates(start.normalize(), end.normalize())
+    index = pd.DatetimeIndex((days.asi8[:, None] + session_offsets(freq, sessions)[None, :]).ravel())
+    return index[(index >= start) & (index <= end)]
+
+
+def bars_per_year(freq: str, sessions=TRADING_SESSIONS,
+                  trading_days_per_year: int = TRADING_DAYS_PER_YEAR) -> float:
+    """
+    由K线周期换算每年的K线数（年化系数），与 trading_dates 生成的K线一致
+     freq: pandas 周期字符串，如 '1min'、'15min'、'1h'、'B'、'D'、'W'、'M'
+    日内周期按每日交易时段内的K线根数换算，工作日日线 'B' 为 252，自然日日线 'D'（含周末）为 365，
+    周、月、季、年线按自然周期换算
+    """
+    offset = pd.tseries.frequencies.to_offset(freq)
+    code = offset.rule_code.split('-')[0]
+    if code in ('B', 'C'):
+        return trading_days_per_year / offset.n
+    if code == 'D':
+        return 365 / offset.n
+    if code == 'W':
+        return 52 / offset.n
+    if code in ('M', 'ME', 'BM', 'BME', 'MS', 'BMS'):
+        return 12 / offset.n
+    if code in ('Q', 'QE', 'BQ', 'BQE', 'QS', 'BQS'):
+        return 4 / offset.n
+    if code in ('A', 'Y', 'YE', 'BA', 'BY', 'BYE', 'AS', 'YS', 'BAS', 'BYS'):
+        return 1 / offset.n
+
+    # 剩下的是固定时长的日内周期（时、分、秒……）
+    return len(session_offsets(freq, sessions)) * trading_days_per_year
+
+
+def infer_bars_per_year(index: pd.DatetimeIndex,
+                        trading_days_per_year: int = TRADING_DAYS_PER_YEAR) -> float:
+    """
+    由时间索引推断年化系数：日内数据按每个交易日实际的K线根数（中位数）换算，
+    不依赖交易时段的设定；日线含周末时按自然日 365 换算，否则为 252；更长周期按相邻K线的间隔换算
+    """
+    if len(index) < 2:
+        return trading_days_per_year
+    step = pd.Series(index).diff().median()
+    if step < pd.Timedelta('1D'):
+        bars_per_day = pd.Series(index.normalize()).value_counts().median()
+        return trading_days_per_year * bars_per_day
+    days = step / pd.Timedelta('1D')
+    if days <= 1:
+        return 365 if (index.weekday >= 5).any() else trading_days_per_year
+    return 365.25 / days
+
+
+@lru_cache(maxsize=None)
+def check_bars_per_year(freq: str, sessions=TRADING_SESSIONS, tolerance: float = 0.05) -> float:
+    """
+    返回 bars_per_year(freq)，并检查它与 trading_dates 按该周期实际生成的K线根数是否一致（相对误差在 tolerance 内），
+    不一致时抛出 ValueError，此时应显式传入年化系数
+    """
+    expected = bars_per_year(freq, sessions)
+    # 日内周期取两周、其余取三年作为样本，足够推断K线密度
+    end = '2024-01-14' if is_intraday(freq) else '2026-12-31'
+    actual = infer_bars_per_year(trading_dates('2024-01-01', end, freq, sessions))
+    if abs(actual - expected) > tolerance * expected:
+        raise ValueError(f"周期 {freq} 的年化系数 {expected:g} 与实际生成的K线密度（每年约 {actual:g} 根）不一致，"
+                         f"请显式指定 periods_per_year")
+    return expected
+
+
+class ResamplePyramid:
+    """
+    多周期K线金字塔
+    每一级由比它细、且周期能整除它的最粗一级聚合而来，建好后缓存；
+    不在金字塔里的周期（如 '30min'）也按同样的规则就近聚合
+    """
+    def __init__(self, bars: Union[pd.DataFrame, pd.Series], levels: Sequence[str] = PYRAMID_LEVELS,
+                 cache_dir: Optional[str] = None, sessions=TRADING_SESSIONS):
+        """
+         bars: 最细一级的K线，DatetimeIndex 索引，含 close 列（open/high/low/volume 可选）；
+               也可以直接传收盘价 Series
+         levels: 金字塔各级周期，从细到粗，后一级必须是前一级的整数倍；第一级应与 bars 的周期相同
+         cache_dir: 可选，各级K线落盘缓存的目录，同一份原始数据下次直接读取
+         sessions: 交易时段，日内各级K线从每个时段的开盘起切分，与 session_offsets 一致
+        """
+        if isinstance(bars, pd.Series):
+            bars = bars.to_frame('close')
+        if 'close' not in bars.columns:
+            raise ValueError("bars 必须包含 close 列")
+        if not isinstance(bars.index, pd.DatetimeIndex):
+            raise ValueError("bars 的索引必须是 DatetimeIndex")
+
+        spans = [pd.Timedelta(level) for level in levels]
+        for finer, coarser, level in zip(spans, spans[1:], levels[1:]):
+            if coarser % finer != pd.Timedelta(0):
+                raise ValueError(f"周期 {level} 不是上一级的整数倍")
+
+        # 最细一级补齐 OHLC：只有收盘价时一根K线的开高低都等于收盘价
+        base = bars.sort_index()
+        for column in ('open', 'high', 'low'):
+            if column not in base.columns:
+                base[column] = base['close']
+        columns = [c for c in OHLC_AGG if c in base.columns]
+
+        self.levels = tuple(levels)
+        self.cache_dir = cache_dir
+        self.sessions = sessions
+        self._spans = dict(zip(self.levels, spans))
+        self._frames = {self.levels[0]: base[columns]}          # 已建好的各级K线
+        self._fingerprint = None
+
+    def _cache_path(self, level: str) -> str:
+        if self._fingerprint is None:
+            from result_cache import fingerprint_array
+            base = self._frames[self.levels[0]]
+            data = fingerprint_array(np.column_stack(
+                [base.index.asi8.astype(np.float64)] + [base[c].to_numpy(np.float64) for c in base.columns]))
+            # K线切分方式随交易时段变化，一并计入
+            self._fingerprint = hashlib.sha256(f"{data}:{self.sessions}".encode()).hexdigest()[:24]
+        return os.path.join(self.cache_dir, f"{self._fingerprint}_{level}.pkl")
+
+    def _source_level(self, span: pd.Timedelta) -> str:
+        # 已知各级中能整除目标周期的最粗一级，逐级聚合保证只用到相邻一级
+        candidates = [level for level in self.levels
+                      if self._spans[level] < span and span % self._spans[level] == pd.Timedelta(0)]
+        if not candidates:
+            raise ValueError(f"周期 {span} 无法由金字塔中的任何一级聚合得到")
+        return max(candidates, key=lambda level: self._spans[level])
+
+    def get(self, level: str) -> pd.DataFrame:
+        """
+        返回某一周期的 OHLC(V) K线，第一次访问时构建并缓存（同时构建它依赖的更细各级）
+        日内周期在每个交易时段内从开盘起切分（1h 为 9:30、10:30、13:00、14:00），与 freq 直接生成的K线一致；
+        空的时间段（午休、夜间、周末）不产生K线
+        """
+        if level in self._frames:
+            return self._frames[level]
+
+        path = self._cache_path(level) if self.cache_dir is not None else None
+        if path is not None and os.path.exists(path):
+            frame = pd.read_pickle(path)
+        else:
+            span = pd.Timedelta(level)
+            source = self.get(self._source_level(span))
+            agg = {column: OHLC_AGG[column] for column in source.columns}
+            if is_intraday(level):
+                frame = source.groupby(self._session_labels(source.index, span)).agg(agg)
+                frame.index.name = source.index.name
+            else:
+                frame = source.resample(level, label='left', closed='left').agg(agg)
+            frame = frame[frame['close'].notna()]
+            if path is not None:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                frame.to_pickle(path)
+        self._frames[level] = frame
+        if level not in self._spans:
+            self._spans[level] = pd.Timedelta(level)
+        return frame
+
+    def _session_labels(self, index: pd.DatetimeIndex, span: pd.Timedelta) -> pd.DatetimeIndex:
+        # 每根K线归入所在交易时段内、从开盘起按 span 切分的区间，以区间起始时刻标记；
+        # 不在任何时段内的K线（早于第一个时段）按自然时钟切分
+        values = index.asi8
+        day = pd.Timedelta('1D').value
+        tod = values % day
+        starts = np.array([pd.Timedelta(f"{start}:00").value for start, _ in self.sessions])
+        pos = np.searchsorted(starts, tod, side='right') - 1
+        anchor = np.where(pos >= 0, starts[np.maximum(pos, 0)], 0)
+        step = span.value
+        return pd.DatetimeIndex(values - tod + anchor + (tod - anchor) // step * step)
+
+    def build(self) -> 'ResamplePyramid':
+        """
+        一次性建好金字塔所有级别
+        """
+        for level in self.levels:
+            self.get(level)
+        return self
+
+    def close(self, level: str) -> np.ndarray:
+        return self.get(level)['close'].to_numpy(dtype=np.float64)
+
+    def bars_per_year(self, level: str) -> float:
+        # 按聚合后实际的K线根数推断，与 bars_per_year(level) 一致（1h 每天 4 根），原始数据有缺失时也准确
+        return infer_bars_per_year(self.get(level).index)
+
+    def run_backtest(self, level: str, ma5_window: int = 5, ma20_window: int = 20,
+                     stop_loss_threshold: float = -0.05, risk_free_rate: float = 0.03) -> Dict[str, Any]:
+        """
+        在某一周期的K线上跑均线+止损策略，年化系数按该周期每天实际的K线根数换算
+        """
+        result = backtest_np(self.close(level), ma5_window, ma20_window, stop_loss_threshold,
+                             risk_free_rate, self.bars_per_year(level))
+        return {name: float(value) for name, value in result.items()}
+
+    def run_all(self, levels: Optional[Sequence[str]] = None, **params) -> pd.DataFrame:
+        """
+        在多个周期上跑同一组策略参数，返回以周期为索引的绩效表
+        """
+        rows = {}
+        for level in levels or self.levels:
+            rows[level] = {"bar_count": len(self.get(level)), **self.run_backtest(level, **params)}
+        return pd.DataFrame.from_dict(rows, orient='index')
+
+
+def generate_minute_bars(day_count: int = 250, start_date='2025-01-02', init_price: float = 100.0,
+                         random_seed: int = 101) -> pd.DataFrame:
+    """
+    模拟A股交易时段（9:30-11:30、13:00-15:00）的1分钟收盘价，用于演示
+    """
+    days = trading_dates(start_date, pd.Timestamp(start_date) + pd.Timedelta(days=day_count * 2))[:day_count]
+    index = pd.DatetimeIndex((days.asi8[:, None] + session_offsets('1min')[None, :]).ravel())
+
+    rng = np.random.default_rng(random_seed)
+    daily_change = rng.normal(0, 0.001, index.shape[0])
+    price = init_price * np.cumprod(1 + daily_change)
+    return pd.DataFrame({'close': price, 'volume': rng.integers(100, 10_000, index.shape[0])}, index=index)
+
+
+def main():
+    pyramid = ResamplePyramid(generate_minute_bars()).build()
+    print(pyramid.run_all().to_string())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,15 @@
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 import time
+import json
+import tracemalloc
+
+from backtest_core import (position_kernel, position_kernel_compact, generate_price_np, rolling_mean_np,
+                           rolling_mean_from_csum, ma_diff_np, crossover_signal_np, crossover_codes_np,
+                           performance_np, compact_signal, expand_signal)
+from plot_utils import get_pyplot, lttb_indices
+from risk_metrics import compute_risk_metrics
+from timeframe_pyramid import trading_dates, check_bars_per_year
 
 class MAStopLossBacktest:
     """
@@ -11,7 +19,11 @@ class MAStopLossBacktest:
     def __init__(self, start_date='2025-01-01', end_date='2025-12-31', 
                  init_price=100.0,              stop_loss_threshold=-0.05, 
                  risk_free_rate=0.03,           ma5_window=5, 
-                 ma20_window=20,                random_seed=101):
+                 ma20_window=20,                random_seed=101,
+                 engine='pandas',               indicator_cache=None,
+                 profile_memory=False,          stage_hook=None,
+                 result_cache=None,             freq='B',
+                 periods_per_year=None,         compact=False):
         """
         初始化回测参数
          start_date: 回测开始日期
@@ -22,7 +34,24 @@ class MAStopLossBacktest:
          ma5_window: 5日均线窗口
          ma20_window: 20日均线窗口
          random_seed: 随机种子
+         engine: 计算引擎 'pandas' 或 'numpy'
+                 numpy 引擎只保留计算绩效所需的连续数组，stock_df 在访问时才构建
+         indicator_cache: 可选的 IndicatorCache，numpy 引擎下用它的累加和计算均线
+         profile_memory: 是否用 tracemalloc 记录每个步骤的峰值内存（有额外开销，默认关闭）
+         stage_hook: 可选回调 stage_hook(步骤名, 统计字典)，每个步骤结束时调用
+         result_cache: 可选的 ResultCache，参数、数据和代码都没变时 run() 直接读取上次的结果
+         freq: K线周期，默认 'B'（工作日日线），也可以是 '1min'、'15min'、'1h' 等日内周期（只生成A股交易时段内的K线）
+         periods_per_year: 年化系数（每年K线数），默认由 freq 换算并检查与生成的K线根数一致：'B' 为 252，'D'（含周末）为 365，
+                           日内周期按交易时段换算
+         compact: 紧凑模式（仅 numpy 引擎），股价和均线用 float32，交易信号用 int8 + bool 掩码，持仓用 bool；
+                  绩效仍按 float64 累计，持仓相同时各指标绝对误差在 1e-4 以内，
+                  均线差值贴近 0 的金叉死叉可能因舍入翻转
         """
+        if engine not in ('pandas', 'numpy'):
+            raise ValueError(f"engine 只能是 'pandas' 或 'numpy'，收到：{engine}")
+        if compact and engine != 'numpy':
+            raise ValueError("compact 模式只支持 numpy 引擎")
+
         # 类的基础参数
         self.start_date = start_date
         self.end_date = end_date
@@ -32,21 +61,90 @@ class MAStopLossBacktest:
         self.ma5_window = ma5_window
         self.ma20_window = ma20_window
         self.random_seed = random_seed
+        self.engine = engine
+        self.indicator_cache = indicator_cache
+        self.profile_memory = profile_memory
+        self.stage_hook = stage_hook
+        self.result_cache = result_cache
+        self.freq = freq
+        self.periods_per_year = periods_per_year or check_bars_per_year(freq)
+        self.compact = compact
         
         # 初始化类中实例属性
+        self.arrays = None                            # numpy 引擎使用的数组
+        self.date_list = None                         # 交易日期
         self.stock_df = None                          # 核心数据框
-        self.day_count = None                         # 交易日数量
+        self.day_count = None                         # K线数量（日线即交易日数量）
         self.annual_strategy_return = None            # 年化策略收益
         self.annual_volatility = None                 # 年化波动率
         self.sharpe_ratio = None                      # 夏普比率
         self.total_benchmark_return = None            # 基准收益
         self.total_strategy_return = None             # 策略最终收益
+        self.max_drawdown = None                      # 最大回撤
+        self.max_drawdown_duration = None             # 最长回撤持续K线数
+        self.sortino_ratio = None                     # 索提诺比率
+        self.calmar_ratio = None                      # 卡玛比率
+        self.hit_rate = None                          # 胜率
+        self.turnover = None                          # 年化换手率
         self.run_time = None                          # 程序运行时间
+        self.stage_report = {}                        # 每个步骤的耗时和内存统计
+        self.cache_hit = False                        # 本次 run() 是否命中结果缓存
+
+    # stock_df 改为属性：numpy 引擎下第一次访问时才由数组构建数据框
+    @property
+    def stock_df(self):
+        if self._stock_df is None and self.arrays is not None:
+            self._stock_df = self._build_stock_df()
+        return self._stock_df
+
+    @stock_df.setter
+    def stock_df(self, value):
+        self._stock_df = value
+
+    def _build_stock_df(self)->pd.DataFrame:
+        # 由 numpy 引擎的数组还原出与 pandas 引擎相同列名的数据框（用于画图或查看）
+        price = self.arrays['price']
+        if self.date_list is None:
+            self.date_list = trading_dates(self.start_date, self.end_date, self.freq)
+        df = pd.DataFrame({'股票收盘价': price}, index=pd.Index(self.date_list, name='交易日期'))
+        if 'position' not in self.arrays:
+            return df
+
+        # 均线和买入价格不常驻内存，需要时重新计算
+        if self.compact:
+            df['5日均线价格'] = rolling_mean_np(price, self.ma5_window).astype(np.float32)
+            df['20日均线价格'] = rolling_mean_np(price, self.ma20_window).astype(np.float32)
+            df['均线差值'] = ma_diff_np(price, self.ma5_window, self.ma20_window, np.float32)
+            entry_price = position_kernel_compact(price, crossover_codes_np(df['均线差值'].to_numpy()),
+                                                  self.stop_loss_threshold)[2]
+            # 可空的 Int8 列：数据 int8，掩码标出没有信号的日子
+            df['交易信号'] = pd.arrays.IntegerArray(self.arrays['trade_signal'], ~self.arrays['signal_mask'])
+        else:
+            df['5日均线价格'] = rolling_mean_np(price, self.ma5_window)
+            df['20日均线价格'] = rolling_mean_np(price, self.ma20_window)
+            df['均线差值'] = df['5日均线价格'] - df['20日均线价格']
+            _, entry_price, _ = position_kernel(price, crossover_signal_np(df['均线差值'].to_numpy()),
+                                                self.stop_loss_threshold)
+            df['交易信号'] = self.arrays['trade_signal']
+        df['买入价格'] = entry_price
+        df['浮亏比例'] = (df['股票收盘价'] - df['买入价格']) / df['买入价格']
+        df['最终持仓状态'] = self.arrays['position']
+        df['股票日收益率'] = (df['股票收盘价'] / df['股票收盘价'].shift(1)) - 1
+        df['策略日收益'] = df['股票日收益率'] * df['最终持仓状态']
+        return df
 
     def generate_stock_data(self)->None:
+        if self.engine == 'numpy':
+            self.date_list = trading_dates(self.start_date, self.end_date, self.freq)
+            self.day_count = len(self.date_list)
+            price = generate_price_np(self.day_count, self.init_price, self.random_seed)
+            self.arrays = {'price': price.astype(np.float32) if self.compact else price}
+            self.stock_df = None
+            return
+
         np.random.seed(self.random_seed)
         # 生成交易日  freq='B'即跳过周末
-        date_list = pd.date_range(start=self.start_date, end=self.end_date, freq='B')
+        date_list = trading_dates(self.start_date, self.end_date, self.freq)
         self.day_count = len(date_list)
         
         # 生成涨跌幅和股价
@@ -64,6 +162,16 @@ class MAStopLossBacktest:
 
      #计算均线和均线差值
     def calculate_ma(self)->None: 
+        if self.engine == 'numpy':
+            price = self.arrays['price']
+            if self.indicator_cache is not None:
+                csum = self.indicator_cache.cumsum(price)
+                self.arrays['ma_diff'] = (rolling_mean_from_csum(csum, self.ma5_window, price.dtype)
+                                          - rolling_mean_from_csum(csum, self.ma20_window, price.dtype))
+            else:
+                self.arrays['ma_diff'] = ma_diff_np(price, self.ma5_window, self.ma20_window, price.dtype)
+            return
+
         roll5 = self.stock_df['股票收盘价'].rolling(window=self.ma5_window)   #滚轮对象 截取五个数据
         roll20 = self.stock_df['股票收盘价'].rolling(window=self.ma20_window)
         self.stock_df['5日均线价格'] = roll5.mean()
@@ -73,6 +181,21 @@ class MAStopLossBacktest:
 
    # 生成交易信号（金叉买入、死叉卖出）以及止损逻辑
     def generate_trade_signal(self)->None:
+        if self.engine == 'numpy':
+            # 均线差值用完即丢，只保留实际交易信号和持仓
+            if self.compact:
+                signal = crossover_codes_np(self.arrays.pop('ma_diff'))
+                trade_signal, signal_mask, _, position = position_kernel_compact(
+                    self.arrays['price'], signal, self.stop_loss_threshold)
+                self.arrays.update(trade_signal=trade_signal, signal_mask=signal_mask, position=position)
+                self.stock_df = None
+                return
+            signal = crossover_signal_np(self.arrays.pop('ma_diff'))
+            trade_signal, _, position = position_kernel(self.arrays['price'], signal, self.stop_loss_threshold)
+            self.arrays['trade_signal'] = trade_signal
+            self.arrays['position'] = position
+            self.stock_df = None
+            return
        
         # 初始化交易信号
         self.stock_df['交易信号'] = np.nan
@@ -84,32 +207,34 @@ class MAStopLossBacktest:
         self.stock_df.loc[buy_condition, '交易信号'] = 1
         self.stock_df.loc[sell_condition, '交易信号'] = 0
         
-        # 如果当天没有新的买入信号，就沿用上一次买入时的价格，直到下一次买入。
-        self.stock_df['买入价格'] = np.nan
-        buy_dates = self.stock_df[self.stock_df['交易信号'] == 1].index
-        self.stock_df.loc[buy_dates, '买入价格'] = self.stock_df.loc[buy_dates, '股票收盘价']
-        self.stock_df['买入价格'] = self.stock_df['买入价格'].fillna(method='ffill')
-        
-        # 计算浮亏比例并触发止损
+        # 持仓状态机：只有空仓时的金叉才开仓，死叉或止损平仓后买入价格失效，等下一次金叉再入场
+        # 交易信号改写为实际发生的买卖点（含止损卖出）
+        trade_signal, entry_price, position = position_kernel(
+            self.stock_df['股票收盘价'].to_numpy(), self.stock_df['交易信号'].to_numpy(), self.stop_loss_threshold)
+        self.stock_df['交易信号'] = trade_signal
+        self.stock_df['买入价格'] = entry_price
         self.stock_df['浮亏比例'] = (self.stock_df['股票收盘价'] - self.stock_df['买入价格']) / self.stock_df['买入价格']
-        stop_loss_condition = self.stock_df['浮亏比例'] <= self.stop_loss_threshold
-        self.stock_df.loc[stop_loss_condition, '交易信号'] = 0   # 触发止损，交易信号设为0（卖出）
-        
-        # 确定最终持仓状态
-        self.stock_df['最终持仓状态'] = self.stock_df['交易信号'].fillna(method='ffill').fillna(0)
+        self.stock_df['最终持仓状态'] = position
 
     def calculate_performance(self)->None:
+        if self.engine == 'numpy':
+            price, position = self.arrays['price'], self.arrays['position']
+            metrics = performance_np(price, position, self.risk_free_rate, self.periods_per_year)
+            for name, value in metrics.items():
+                setattr(self, name, float(value))
+            self._set_risk_metrics((price[1:] / price[:-1] - 1) * position[1:], position[1:])
+            return
+
         # 计算日收益率
-        self.stock_df['股票日收益率'] = (self.stock_df['股票收盘价'] / self.stock_df['股票收盘价'].shift(1)) - 1
-        self.stock_df['策略日收益'] = self.stock_df['股票日收益率'] * self.stock_df['最终持仓状态']
+        self._add_return_columns()
         
         # 年化策略收益
-        total_strategy_return = (1 + self.stock_df['策略日收益']).prod()     #累成收益率
-        self.annual_strategy_return = total_strategy_return ** (252 / self.day_count) - 1
+        total_strategy_return = (1 + self.stock_df['策略日收益']).prod()     #累成收益率（只算一次，最终收益复用）
+        self.annual_strategy_return = total_strategy_return ** (self.periods_per_year / self.day_count) - 1
         
         # 年化波动率
         daily_volatility = self.stock_df['策略日收益'].std()   #。std（）计算标准差
-        self.annual_volatility = daily_volatility * np.sqrt(252)
+        self.annual_volatility = daily_volatility * np.sqrt(self.periods_per_year)
         
         # 夏普比率
         if self.annual_volatility != 0:
@@ -119,8 +244,25 @@ class MAStopLossBacktest:
         
         # 基准收益（买入持有）和策略最终收益
         self.total_benchmark_return = (1 + self.stock_df['股票日收益率']).prod() - 1
-        self.total_strategy_return = (1 + self.stock_df['策略日收益']).prod() - 1
+        self.total_strategy_return = total_strategy_return - 1
+
+        # 最大回撤、索提诺、卡玛等风险指标
+        self._set_risk_metrics(self.stock_df['策略日收益'].to_numpy()[1:],
+                               self.stock_df['最终持仓状态'].to_numpy()[1:])
+
+    def _add_return_columns(self)->None:
+        self.stock_df['股票日收益率'] = (self.stock_df['股票收盘价'] / self.stock_df['股票收盘价'].shift(1)) - 1
+        self.stock_df['策略日收益'] = self.stock_df['股票日收益率'] * self.stock_df['最终持仓状态']
 
+    # 夏普等基础指标已由上面算出，这里只补充其余风险指标
+    RISK_METRICS = ('max_drawdown', 'max_drawdown_duration', 'sortino_ratio', 'calmar_ratio', 'hit_rate', 'turnover')
+
+    def _set_risk_metrics(self, strategy_return, position)->None:
+        metrics = compute_risk_metrics(strategy_return, position, self.risk_free_rate, self.periods_per_year,
+                                       day_count=self.day_count)
+        for name in self.RISK_METRICS:
+            setattr(self, name, float(metrics[name]))
+        self.max_drawdown_duration = int(self.max_drawdown_duration)
 
     #打印结果
     def print_results(self):
@@ -132,28 +274,38 @@ class MAStopLossBacktest:
         print(f"策略年化收益：{self.annual_strategy_return:.2%}")
         print(f"策略年化波动率：{self.annual_volatility:.2%}")
         print(f"策略夏普比率：{self.sharpe_ratio:.2f}")
+        print(f"策略最大回撤：{self.max_drawdown:.2%}（最长 {self.max_drawdown_duration} 根K线）")
+        print(f"策略索提诺比率：{self.sortino_ratio:.2f}  卡玛比率：{self.calmar_ratio:.2f}")
         print(f"\n程序运行总耗时：{self.run_time:.2f} 秒")
 
 
         #结果绘图
-    def plot_results(self):
-    
-        plt.rcParams['font.sans-serif'] = ['SimHei']
-        plt.rcParams['axes.unicode_minus'] = False
+    def plot_results(self, save_path=None, max_points=2000):
+        """
+        画股价、均线和买卖点
+         save_path: 给定时不弹窗口，用 Agg 后端直接保存成图片（适合服务器批量任务）
+         max_points: 折线最多画多少个点，超过时用 LTTB 降采样；None 表示不降采样
+        """
+        plt = get_pyplot(headless=save_path is not None)
+        df = self.stock_df
+
+        # 长序列只画降采样后的点，均线与股价使用同一组下标保持对齐
+        if max_points is not None and len(df) > max_points:
+            line_df = df.iloc[lttb_indices(df['股票收盘价'].to_numpy(), max_points)]
+        else:
+            line_df = df
         
         # 绘图
         plt.figure(figsize=(10, 6))
-        plt.plot(self.stock_df['股票收盘价'], label='股票收盘价', color='blue')
-        plt.plot(self.stock_df['5日均线价格'], label='5日均线', color='red')
-        plt.plot(self.stock_df['20日均线价格'], label='20日均线', color='green')
+        plt.plot(line_df['股票收盘价'], label='股票收盘价', color='blue')
+        plt.plot(line_df['5日均线价格'], label='5日均线', color='red')
+        plt.plot(line_df['20日均线价格'], label='20日均线', color='green')
         
         # 标记买入/卖出点
-        plt.scatter(self.stock_df[self.stock_df['交易信号']==1].index, 
-                    self.stock_df[self.stock_df['交易信号']==1]['股票收盘价'], 
-                    marker='^', color='green', s=80, label='买入')
-        plt.scatter(self.stock_df[self.stock_df['交易信号']==0].index, 
-                    self.stock_df[self.stock_df['交易信号']==0]['股票收盘价'], 
-                    marker='v', color='red', s=80, label='卖出')
+        buy_df = df[df['交易信号'].eq(1).fillna(False)]          # 紧凑模式下交易信号是可空的 Int8
+        sell_df = df[df['交易信号'].eq(0).fillna(False)]
+        plt.scatter(buy_df.index, buy_df['股票收盘价'], marker='^', color='green', s=80, label='买入')
+        plt.scatter(sell_df.index, sell_df['股票收盘价'], marker='v', color='red', s=80, label='卖出')
         
         # 图表设置
         plt.title('股票价格与交易信号（带止损）', fontsize=12)
@@ -161,24 +313,152 @@ class MAStopLossBacktest:
         plt.ylabel('价格（元）')
         plt.legend()
         plt.grid(True, alpha=0.3)
-        plt.show()
+        if save_path is not None:
+            plt.savefig(save_path, dpi=100, bbox_inches='tight')
+            plt.close()
+        else:
+            plt.show()
 
-    def run(self)->None:              #一次完整运行 更加便利 切可以防止调用类中函数顺序错误
-        start_time = time.time()
-        
-        # 按顺序执行步骤
-        self.generate_stock_data()
-        self.calculate_ma()
-        self.generate_trade_signal()
-        self.calculate_performance()
-        
-        # 计算运行时间
-        end_time = time.time()
-        self.run_time = end_time - start_time
-        
-        self.print_results()
-        self.plot_results()
+    def export(self, path, include_indicators=True):
+        """
+        把股价、均线、交易信号、持仓和绩效导出为 Parquet（.parquet）或 Arrow IPC（.arrow），需要 pyarrow
+        数值列直接共享 NumPy 数组的内存，绩效写在文件的 schema 元数据里
+        """
+        from arrow_export import export_backtest
+        export_backtest(self, path, include_indicators)
+
+    def _run_stage(self, stage_name, stage_func, *args, **kwargs):
+        # 执行一个步骤并记录墙钟时间、CPU 时间，以及（可选）峰值内存
+        if self.profile_memory:
+            tracemalloc.reset_peak()
+            mem_start = tracemalloc.get_traced_memory()[0]
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+
+        stage_func(*args, **kwargs)
+
+        stats = {
+            "wall_time": time.perf_counter() - wall_start,
+            "cpu_time": time.process_time() - cpu_start,
+        }
+        if self.profile_memory:
+            # 峰值内存为相对步骤开始时新增的部分
+            stats["peak_memory"] = tracemalloc.get_traced_memory()[1] - mem_start
+        self.stage_report[stage_name] = stats
+        if self.stage_hook is not None:
+            self.stage_hook(stage_name, stats)
+
+    def profile_report(self, as_json=False):
+        """
+        返回每个步骤的统计（秒 / 字节），as_json=True 时返回 JSON 字符串
+        """
+        report = {
+            "engine": self.engine,
+            "day_count": self.day_count,
+            "run_time": self.run_time,
+            "stages": self.stage_report,
+        }
+        return json.dumps(report, ensure_ascii=False, indent=2) if as_json else report
+
+    # 决定回测结果的参数，作为结果缓存键的一部分
+    RESULT_METRICS = ('day_count', 'total_benchmark_return', 'total_strategy_return',
+                      'annual_strategy_return', 'annual_volatility', 'sharpe_ratio') + RISK_METRICS
+
+    def cache_params(self)->dict:
+        return {
+            "start_date": str(self.start_date), "end_date": str(self.end_date),
+            "init_price": self.init_price, "stop_loss_threshold": self.stop_loss_threshold,
+            "risk_free_rate": self.risk_free_rate, "ma5_window": self.ma5_window,
+            "ma20_window": self.ma20_window, "random_seed": self.random_seed, "engine": self.engine,
+            "freq": self.freq, "periods_per_year": self.periods_per_year, "compact": self.compact,
+        }
+
+    def data_fingerprint(self)->str:
+        # 股价由随机种子模拟生成，生成参数已在 cache_params 里；换成真实数据源时应返回数据的指纹
+        return "synthetic:uniform(-0.02,0.02)"
+
+    def _load_cached_result(self, cache_key, need_arrays)->bool:
+        cached = self.result_cache.get(cache_key)
+        if cached is None:
+            return False
+        metrics, arrays = cached
+        for name, value in metrics.items():
+            setattr(self, name, value)
+
+        if need_arrays and not arrays:
+            # 缓存里只有绩效：绩效直接用，只重算画图需要的股价、均线和交易信号
+            self._run_stage('generate_stock_data', self.generate_stock_data)
+            self._run_stage('calculate_ma', self.calculate_ma)
+            self._run_stage('generate_trade_signal', self.generate_trade_signal)
+            if self.engine == 'pandas':
+                self._add_return_columns()
+            return True
+        if arrays and self.compact:
+            arrays['price'] = arrays['price'].astype(np.float32)
+            arrays['trade_signal'], arrays['signal_mask'] = compact_signal(arrays['trade_signal'])
+            arrays['position'] = arrays['position'].astype(np.bool_)
+        if arrays:
+            self.date_list = None           # 交易日期在构建 stock_df 时才生成
+            self.arrays = arrays
+            self.stock_df = None
+        return True
+
+    def _store_cached_result(self, cache_key)->None:
+        metrics = {name: float(getattr(self, name)) for name in self.RESULT_METRICS}
+        metrics['day_count'] = int(self.day_count)
+        metrics['max_drawdown_duration'] = int(self.max_drawdown_duration)
+        if self.compact:
+            arrays = dict(self.arrays, trade_signal=expand_signal(self.arrays['trade_signal'],
+                                                                   self.arrays['signal_mask']))
+        elif self.engine == 'numpy':
+            arrays = self.arrays
+        else:
+            arrays = {
+                'price': self.stock_df['股票收盘价'].to_numpy(),
+                'trade_signal': self.stock_df['交易信号'].to_numpy(),
+                'position': self.stock_df['最终持仓状态'].to_numpy(),
+            }
+        self.result_cache.put(cache_key, metrics, arrays)
+
+    def run(self, plot=True, save_path=None, verbose=True)->None:   #一次完整运行 更加便利 切可以防止调用类中函数顺序错误
+        # plot=False 时完全不画图（也不会导入 matplotlib）；给了 save_path 则渲染到文件
+        # verbose=False 时不打印结果（批量任务、服务里直接读取结果属性）
+        self.stage_report = {}
+        need_plot = plot or save_path is not None
+        started_tracing = self.profile_memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+
+        try:
+            start_time = time.time()
+
+            # 先查结果缓存，命中则跳过全部计算步骤
+            cache_key = None
+            self.cache_hit = False
+            if self.result_cache is not None:
+                cache_key = self.result_cache.make_key(self.cache_params(), self.data_fingerprint())
+                self.cache_hit = self._load_cached_result(cache_key, need_plot)
 
+            if not self.cache_hit:
+                # 按顺序执行步骤，逐个记录耗时
+                self._run_stage('generate_stock_data', self.generate_stock_data)
+                self._run_stage('calculate_ma', self.calculate_ma)
+                self._run_stage('generate_trade_signal', self.generate_trade_signal)
+                self._run_stage('calculate_performance', self.calculate_performance)
+                if cache_key is not None:
+                    self._store_cached_result(cache_key)
+            
+            # 计算运行时间
+            end_time = time.time()
+            self.run_time = end_time - start_time
+            
+            if verbose:
+                self.print_results()
+            if need_plot:
+                self._run_stage('plot_results', self.plot_results, save_path=save_path)
+        finally:
+            if started_tracing:
+                tracemalloc.stop()
 
     
 def main(): 
@@ -0,0 +1,145 @@
+"""
+滚动前进（walk-forward）优化
+把历史股价切成一段段 训练窗口 + 测试窗口，在训练窗口上网格搜索均线窗口和止损阈值，
+再用选出的参数在紧接着的测试窗口上做样本外回测
+各折（fold）并行执行，股价通过 multiprocessing.shared_memory 共享，不会被 pickle 进每个子进程
+"""
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import List, Tuple, Dict, Any, Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+from backtest_core import generate_price_np, crossover_signal_np, position_kernel, performance_np
+from indicator_cache import IndicatorCache
+
+
+# 子进程里挂载的共享内存和股价视图
+_worker_shm = None
+_worker_price = None
+
+
+def _attach_shared_price(shm_name: str, shape: Tuple[int, ...], dtype: str) -> None:
+    global _worker_shm, _worker_price
+    try:
+        # Python 3.13+：子进程只挂载，不登记到资源回收器，共享内存由主进程负责释放
+        _worker_shm = shared_memory.SharedMemory(name=shm_name, track=False)
+    except TypeError:
+        # 旧版本里进程池子进程与主进程共用同一个资源回收器，重复登记不会导致提前释放
+        _worker_shm = shared_memory.SharedMemory(name=shm_name)
+    _worker_price = np.ndarray(shape, dtype=dtype, buffer=_worker_shm.buf)
+
+
+def make_folds(day_count: int, train_size: int, test_size: int,
+               step: Optional[int] = None) -> List[Tuple[int, int, int]]:
+    """
+    生成每一折的 (训练开始, 测试开始, 测试结束) 下标，训练窗口为 [训练开始, 测试开始)
+     step: 每折向前滚动的K线数，默认等于 test_size（测试窗口首尾相接）
+    """
+    step = step or test_size
+    folds = []
+    start = 0
+    while start + train_size + test_size <= day_count:
+        folds.append((start, start + train_size, start + train_size + test_size))
+        start += step
+    return folds
+
+
+def _evaluate(price: np.ndarray, ma_diff: np.ndarray, stop_loss_threshold: float,
+              risk_free_rate: float, skip: int = 0) -> Dict[str, Any]:
+    position = position_kernel(price, crossover_signal_np(ma_diff), stop_loss_threshold)[2]
+    return performance_np(price[skip:], position[skip:], risk_free_rate)
+
+
+def _run_fold(task: Tuple) -> Dict[str, Any]:
+    """
+    子进程：在一折的训练窗口上选参数，再在测试窗口上做样本外回测
+    """
+    fold, train_start, test_start, test_end, grid, risk_free_rate = task
+    price = _worker_price
+    train_price = price[train_start:test_start]
+    cache = IndicatorCache()
+
+    best = None
+    for ma5_window, ma20_window, stop_loss_threshold in grid:
+        ma_diff = cache.sma(train_price, ma5_window) - cache.sma(train_price, ma20_window)
+        metrics = _evaluate(train_price, ma_diff, stop_loss_threshold, risk_free_rate)
+        if best is None or metrics["sharpe_ratio"] > best[1]["sharpe_ratio"]:
+            best = ((ma5_window, ma20_window, stop_loss_threshold), metrics)
+    (ma5_window, ma20_window, stop_loss_threshold), train_metrics = best
+
+    # 测试窗口前面带上一段训练数据用来预热均线，绩效只统计测试窗口
+    warmup = min(max(ma5_window, ma20_window), test_start)
+    test_price = price[test_start - warmup:test_end]
+    cache = IndicatorCache()
+    ma_diff = cache.sma(test_price, ma5_window) - cache.sma(test_price, ma20_window)
+    test_metrics = _evaluate(test_price, ma_diff, stop_loss_threshold, risk_free_rate, skip=warmup)
+
+    row = {
+        "fold": fold,
+        "train_start": train_start,
+        "test_start": test_start,
+        "test_end": test_end,
+        "ma5_window": ma5_window,
+        "ma20_window": ma20_window,
+        "stop_loss_threshold": stop_loss_threshold,
+        "train_sharpe_ratio": train_metrics["sharpe_ratio"],
+    }
+    row.update({f"test_{name}": value for name, value in test_metrics.items()})
+    return row
+
+
+def run_walk_forward(price: Optional[np.ndarray] = None, train_size: int = 252, test_size: int = 63,
+                     step: Optional[int] = None,
+                     ma5_range: Iterable[int] = range(3, 11), ma20_range: Iterable[int] = range(15, 61, 5),
+                     stop_loss_range: Iterable[float] = (-0.03, -0.05, -0.08),
+                     risk_free_rate=0.03, max_workers=None) -> pd.DataFrame:
+    """
+    滚动前进优化
+     price: 一维收盘价数组，默认生成 10 年的模拟股价
+     train_size / test_size: 训练、测试窗口的K线数
+     ma5_range / ma20_range / stop_loss_range: 参数网格，短均线必须小于长均线
+     max_workers: 进程数，为 1 时在当前进程串行计算
+    返回每一折一行的结果表（选出的参数、训练夏普、样本外绩效）
+    """
+    if price is None:
+        price = generate_price_np(252 * 10)
+    price = np.ascontiguousarray(price, dtype=np.float64)
+
+    grid = [(int(ma5), int(ma20), float(stop)) for ma5, ma20, stop
+            in itertools.product(ma5_range, ma20_range, stop_loss_range) if ma5 < ma20]
+    folds = make_folds(price.shape[0], train_size, test_size, step)
+    tasks = [(i, train_start, test_start, test_end, grid, risk_free_rate)
+             for i, (train_start, test_start, test_end) in enumerate(folds)]
+
+    if max_workers == 1:
+        global _worker_price
+        _worker_price = price
+        return pd.DataFrame(list(map(_run_fold, tasks)))
+
+    # 股价复制进共享内存一次，子进程只按名字挂载
+    shm = shared_memory.SharedMemory(create=True, size=price.nbytes)
+    try:
+        shared_price = np.ndarray(price.shape, dtype=price.dtype, buffer=shm.buf)
+        shared_price[:] = price
+        del shared_price
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_attach_shared_price,
+                                 initargs=(shm.name, price.shape, price.dtype.str)) as executor:
+            rows = list(executor.map(_run_fold, tasks))
+    finally:
+        shm.close()
+        shm.unlink()
+
+    return pd.DataFrame(rows)
+
+
+def main():
+    result_df = run_walk_forward()
+    print(result_df[["fold", "ma5_window", "ma20_window", "stop_loss_threshold",
+                     "train_sharpe_ratio", "test_sharpe_ratio", "test_total_strategy_return"]].to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()